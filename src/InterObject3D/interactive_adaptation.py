@@ -2,6 +2,7 @@ import torch
 import numpy as np
 
 import MinkowskiEngine as ME
+from torch.profiler import record_function
 from torch.utils.data import Dataset, DataLoader
 import pickle
 import io
@@ -308,15 +309,18 @@ class InteractiveSegmentationModel(object):
     def prediction(self, feats, coords, model, device, voxel_size=0.05):
         #with torch.no_grad():
         # Feed-forward pass and get the prediction
-        sinput = ME.SparseTensor(
-            features=feats,
-            coordinates=ME.utils.batched_coordinates([coords / voxel_size]),
-            quantization_mode=ME.SparseTensorQuantizationMode.UNWEIGHTED_AVERAGE,
-            device=device
-        )  # .to(device)
+        with record_function('sparse_tensor'):
+            sinput = ME.SparseTensor(
+                features=feats,
+                coordinates=ME.utils.batched_coordinates([coords / voxel_size]),
+                quantization_mode=ME.SparseTensorQuantizationMode.UNWEIGHTED_AVERAGE,
+                device=device
+            )  # .to(device)
         model.eval()
-        logits = model(sinput)
-        logits = logits.slice(sinput)
+        with record_function('forward'):
+            logits = model(sinput)
+        with record_function('slice'):
+            logits = logits.slice(sinput)
         # get the prediction on the input tensor field
         # out_field = soutput.slice(in_field)
         logits = logits.F
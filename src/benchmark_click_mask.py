@@ -0,0 +1,78 @@
+import argparse
+import time
+
+import open3d as o3d
+import numpy as np
+
+from spatial_index import SpatialIndex
+
+
+def synthetic_scene(n_points, seed=0):
+    # Random points in a 10 x 10 x 3 m room
+    rng = np.random.default_rng(seed)
+    return (rng.random((n_points, 3)) * [10, 10, 3]).astype(np.float32)
+
+
+def open3d_click_mask(positions, points, click_area):
+    # Previous implementation of process_click, KD-tree per sample and one tensor write per point
+    size = len(positions)
+    pcd = o3d.t.geometry.PointCloud(o3d.core.Tensor(positions))
+    pcd.point.maskPositive = o3d.core.Tensor(np.zeros((size, 1), dtype=np.uint8))
+
+    pcd_tree = o3d.geometry.PointCloud()
+    pcd_tree.points = o3d.utility.Vector3dVector(positions)
+    tree = o3d.geometry.KDTreeFlann(pcd_tree)
+
+    for point in points:
+        [_, idx, _] = tree.search_radius_vector_3d(pcd_tree.points[point], click_area)
+        for i in idx:
+            pcd.point.maskPositive[i] = 1
+    return pcd.point.maskPositive.numpy()[:, 0]
+
+
+def numpy_click_mask(index, positions, points, click_area):
+    # Current implementation, cached spatial index and one scatter for all clicks
+    mask = np.zeros(len(positions), dtype=np.uint8)
+    mask[index.query_radius_union(positions[points], click_area)] = 1
+    return mask
+
+
+def measure(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main(args):
+    positions = synthetic_scene(args.points)
+    rng = np.random.default_rng(1)
+    points = rng.choice(len(positions), args.clicks, replace=False).tolist()
+    print(f'Synthetic scene: {len(positions)} points, {args.clicks} clicks, click_area={args.click_area}')
+
+    time_index, index = measure(lambda: SpatialIndex(positions, args.click_area), args.repeats)
+    time_open3d, mask_open3d = measure(lambda: open3d_click_mask(positions, points, args.click_area), args.repeats)
+    time_numpy, mask_numpy = measure(lambda: numpy_click_mask(index, positions, points, args.click_area), args.repeats)
+
+    print(f'clicked points: {int(mask_numpy.sum())} (open3d: {int(mask_open3d.sum())})')
+    print(f'open3d tensor writes:   {time_open3d * 1000:.2f} ms / sample')
+    print(f'numpy batched scatter:  {time_numpy * 1000:.2f} ms / sample '
+          f'(+ {time_index * 1000:.2f} ms once per scene for the spatial index)')
+    print(f'speedup:                {time_open3d / time_numpy:.1f}x')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--points", type=int, default=1000000,
+                        help="Number of points of the synthetic scene (default: 1000000)")
+    parser.add_argument("-n", "--clicks", type=int, default=9,
+                        help="Number of clicks in one sample (default: 9)")
+    parser.add_argument("-c", "--click_area", type=float, default=0.3,
+                        help="Click area (default: 0.3)")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of measured runs, the fastest one is reported (default: 3)")
+    args = parser.parse_args()
+
+    main(args)
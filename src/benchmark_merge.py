@@ -0,0 +1,74 @@
+import argparse
+import time
+
+import open3d as o3d
+import numpy as np
+
+from convert_dataset import merge_annotations
+
+
+def synthetic_room(n_objects, points_per_object, seed=0):
+    # Objects with random sizes around points_per_object, rows are "x y z r g b" like in S3DIS
+    rng = np.random.default_rng(seed)
+    annotations = []
+    for _ in range(n_objects):
+        size = int(rng.integers(points_per_object // 2, points_per_object * 3 // 2 + 1))
+        positions = rng.uniform(0, 10, (size, 3))
+        colors = rng.integers(0, 256, (size, 3)).astype(np.float64)
+        annotations.append(np.concatenate((positions, colors), axis=1))
+    return annotations
+
+
+def merge_by_appending(annotations):
+    # Previous implementation, every object is appended to the growing room
+    merged_pcd = o3d.t.geometry.PointCloud()
+    for group, data in enumerate(annotations):
+        size = len(data)
+        pcd = o3d.t.geometry.PointCloud(o3d.core.Tensor(data[:, :3].astype(np.float32)))
+        pcd.point.colors = o3d.core.Tensor((data[:, 3:] / 255).astype(np.float32))
+        pcd.point.group = o3d.core.Tensor(np.full((size, 1), group).astype(np.uint8))
+        pcd.point.maskPositive = o3d.core.Tensor(np.zeros((size, 1), dtype=np.uint8))
+        pcd.point.maskNegative = o3d.core.Tensor(np.zeros((size, 1), dtype=np.uint8))
+        merged_pcd = pcd if group == 0 else merged_pcd + pcd
+    return merged_pcd
+
+
+def measure(merge, annotations, repeats):
+    times = []
+    for _ in range(repeats):
+        # merge_annotations empties the list it is given, so every run gets its own copy
+        objects = list(annotations)
+        start = time.perf_counter()
+        pcd = merge(objects)
+        times.append(time.perf_counter() - start)
+    return min(times), pcd
+
+
+def main(args):
+    annotations = synthetic_room(args.objects, args.points)
+    n_points = sum(len(data) for data in annotations)
+    print(f'Synthetic room: {args.objects} objects, {n_points} points')
+
+    time_append, pcd_append = measure(merge_by_appending, annotations, args.repeats)
+    time_merge, pcd_merge = measure(merge_annotations, annotations, args.repeats)
+
+    for attribute in ['positions', 'colors', 'group', 'maskPositive', 'maskNegative']:
+        assert np.array_equal(pcd_append.point[attribute].numpy(), pcd_merge.point[attribute].numpy()), \
+            f'Merged rooms differ in {attribute}'
+
+    print(f'append merge:       {time_append:.3f} s')
+    print(f'preallocated merge: {time_merge:.3f} s')
+    print(f'speedup:            {time_append / time_merge:.1f}x')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--objects", type=int, default=300,
+                        help="Number of objects in the synthetic room (default: 300)")
+    parser.add_argument("-p", "--points", type=int, default=10000,
+                        help="Average number of points per object (default: 10000)")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of measured runs, the fastest one is reported (default: 3)")
+    args = parser.parse_args()
+
+    main(args)
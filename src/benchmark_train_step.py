@@ -0,0 +1,104 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+import MinkowskiEngine as ME
+
+from InterObject3D import minkunet
+from train_step import labels_to_logit_shape, point_batch_inputs, optimize, point_predictions
+
+
+def synthetic_batch(batch_size, n_points, voxel_size, seed=0):
+    # Rooms of random points with one box-shaped object and a clicked area inside of it, collated like in train.py
+    rng = np.random.default_rng(seed)
+    samples = []
+    for _ in range(batch_size):
+        positions = rng.random((n_points, 3)) * [10, 10, 3]
+        center = rng.random(3) * [8, 8, 1] + [1, 1, 1]
+        label = np.all(np.abs(positions - center) < 0.5, axis=1)
+        feats = np.zeros((n_points, 5), dtype=np.float32)
+        feats[:, :3] = rng.random((n_points, 3))
+        feats[np.linalg.norm(positions - center, axis=1) < 0.2, 3] = 1
+        samples.append((positions / voxel_size, feats, label.astype(np.uint8).reshape((-1, 1))))
+    return ME.utils.batch_sparse_collate(samples)
+
+
+def mean_iou(pred, labels):
+    # InteractiveSegmentationModel.mean_iou
+    union = torch.sum(torch.logical_or(labels, pred))
+    return 100 * (labels * pred).sum() / union
+
+
+def legacy_step(model, optimizer, criterion, batch, device, point_iou):
+    # Previous train.py step: features and labels quantized together, then two more SparseTensors
+    # for inputs and labels, and the output sliced back to points for the train IoU
+    coords, feats, labels = batch
+    labels = labels_to_logit_shape(labels).float()
+    super_sinput = ME.SparseTensor(torch.cat((feats.float(), labels), dim=1), coords, device=device)
+    sinput = ME.SparseTensor(super_sinput.F[:, :-2], super_sinput.C, device=device)
+    slabels = ME.SparseTensor(super_sinput.F[:, -2:], super_sinput.C, device=device)
+    sout, loss = optimize(model, optimizer, criterion, sinput, slabels.F)
+    mean_iou(sout.F.argmax(dim=1), slabels.F.argmax(dim=1))
+    if point_iou:
+        out = sout.slice(super_sinput).F.argmax(dim=1).cpu()
+        mean_iou(out, labels.argmax(dim=1))
+    return loss
+
+
+def fused_step(model, optimizer, criterion, batch, device, point_iou):
+    sinput, slabels, point_labels, point_voxels = point_batch_inputs(batch, device)
+    sout, loss = optimize(model, optimizer, criterion, sinput, slabels)
+    mean_iou(sout.F.argmax(dim=1), slabels.argmax(dim=1))
+    if point_iou:
+        out = point_predictions(sout, point_voxels)
+        mean_iou(out, point_labels.to(out.device))
+    return loss
+
+
+def measure(step, model, optimizer, criterion, batch, device, point_iou, repeats):
+    step(model, optimizer, criterion, batch, device, point_iou)  # warm up
+    times = []
+    for _ in range(repeats):
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        step(model, optimizer, criterion, batch, device, point_iou)
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def main(args):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    batch = synthetic_batch(args.batch_size, args.points, args.voxel_size)
+    print(f'Synthetic batch: {args.batch_size} x {args.points} points, voxel_size={args.voxel_size}, device={device}')
+
+    model = getattr(minkunet, args.model_class)(in_channels=5, out_channels=2, D=3).to(device)
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.001)
+    criterion = torch.nn.CrossEntropyLoss(ignore_index=-100)
+
+    for point_iou in [True, False]:
+        time_legacy = measure(legacy_step, model, optimizer, criterion, batch, device, point_iou, args.repeats)
+        time_fused = measure(fused_step, model, optimizer, criterion, batch, device, point_iou, args.repeats)
+        print(f'point IoU {"on" if point_iou else "off"}: legacy step {time_legacy * 1000:.1f} ms, '
+              f'fused step {time_fused * 1000:.1f} ms, saved {(time_legacy - time_fused) * 1000:.1f} ms per step')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--batch_size", type=int, default=4,
+                        help="Number of samples in the batch (default: 4)")
+    parser.add_argument("-p", "--points", type=int, default=200000,
+                        help="Number of points of every sample (default: 200000)")
+    parser.add_argument("-v", "--voxel_size", type=float, default=0.05,
+                        help="Voxel size (default: 0.05)")
+    parser.add_argument("-mc", "--model_class", type=str, default='MinkUNet34C',
+                        help="Model class (default: MinkUNet34C)")
+    parser.add_argument("-r", "--repeats", type=int, default=10,
+                        help="Number of measured steps, the median is reported (default: 10)")
+    args = parser.parse_args()
+
+    main(args)
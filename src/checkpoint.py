@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import queue
+import threading
+
+import torch
+
+# Checkpoints are <model class>_<train step>.pth, e.g. MinkUNet34C_50.pth
+CHECKPOINT_REGEX = r'^(model|MinkUNet\d{2,3}[A-Z]?)_(\d+)\.pth$'
+SCORES_FILE = 'checkpoint_scores.json'
+
+
+def checkpoint_name(model_name, train_step):
+    return f'{model_name}_{train_step}.pth'
+
+
+def snapshot(model):
+    # Copy of the weights on CPU, not changed by further training steps
+    return {key: value.detach().to('cpu', copy=True) for key, value in model.state_dict().items()}
+
+
+def list_checkpoints(output_dir):
+    # {train step: file name} of all checkpoints in output_dir
+    matches = [re.match(CHECKPOINT_REGEX, f) for f in os.listdir(output_dir)]
+    return {int(match.group(2)): match.group(0) for match in matches if match}
+
+
+def find_latest(output_dir):
+    # (train step, path) of the newest checkpoint that can be loaded, (0, None) if there is none. Checkpoints of
+    # CheckpointWriter are complete or missing, but older ones may be cut off by a crash while writing, so the
+    # newest candidates are loaded to check them (usually only the first one).
+    checkpoints = list_checkpoints(output_dir)
+    for step in sorted(checkpoints, reverse=True):
+        path = os.path.join(output_dir, checkpoints[step])
+        if is_loadable(path):
+            return step, path
+        print(f'Skipping checkpoint {path}, it can\'t be loaded')
+    return 0, None
+
+
+def is_loadable(path):
+    if os.path.getsize(path) == 0:
+        return False
+    try:
+        torch.load(path, map_location='cpu')
+    except Exception:
+        return False
+    return True
+
+
+class CheckpointWriter:
+    # Saves checkpoints in a background thread. Tensors are copied to CPU by the caller (a consistent snapshot of
+    # the step), serialization and writing happen in the thread. Files are written to a temporary name and renamed,
+    # so a checkpoint is either complete or missing. With keep_last or keep_best only the keep_last newest checkpoints
+    # (at least the newest one, to continue training from) and the keep_best checkpoints with the highest score are
+    # kept, all checkpoints are kept otherwise. A failed write is raised by the next save or by close.
+    def __init__(self, output_dir, keep_last=0, keep_best=0, max_pending=2):
+        self.output_dir = output_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.scores = self.load_scores()
+        self.error = None
+        self.closed = False
+        self.written = set()  # names of checkpoints written by this writer
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, model, train_step, score=None):
+        self.save_state_dict(snapshot(model), checkpoint_name(model.__class__.__name__, train_step), score)
+
+    def save_state_dict(self, state_dict, name, score=None):
+        # Blocks only when max_pending checkpoints are still waiting to be written
+        self.raise_error()
+        self.queue.put((state_dict, name, score))
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            state_dict, name, score = item
+            try:
+                self.write(state_dict, name, score)
+            except Exception as e:
+                print(f'Saving checkpoint {name} failed: {e}')
+                self.error = e
+            self.queue.task_done()
+
+    def write(self, state_dict, name, score):
+        path = os.path.join(self.output_dir, name)
+        # The same step saved again (a validated step that was also a save step) only gets its score
+        if name not in self.written or not os.path.exists(path):
+            tmp_path = os.path.join(self.output_dir, f'.{name}.tmp')
+            with open(tmp_path, 'wb') as f:
+                torch.save(state_dict, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self.written.add(name)
+            print(f'Model saved to: {path}\n')
+
+        if score is not None:
+            self.scores[name] = float(score)
+        self.apply_retention()
+        self.save_scores()
+
+    def apply_retention(self):
+        if self.keep_last <= 0 and self.keep_best <= 0:
+            return
+        checkpoints = list_checkpoints(self.output_dir)
+        keep = {checkpoints[step] for step in sorted(checkpoints, reverse=True)[:max(self.keep_last, 1)]}
+        scored = sorted((name for name in self.scores if name in checkpoints.values()), key=self.scores.get, reverse=True)
+        keep.update(scored[:max(self.keep_best, 0)])
+
+        for name in checkpoints.values():
+            if name not in keep:
+                os.remove(os.path.join(self.output_dir, name))
+                self.scores.pop(name, None)
+
+    def load_scores(self):
+        path = os.path.join(self.output_dir, SCORES_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def save_scores(self):
+        path = os.path.join(self.output_dir, SCORES_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.scores, f, indent=4)
+        os.replace(path + '.tmp', path)
+
+    def wait(self):
+        self.queue.join()
+
+    def close(self):
+        # Writes the checkpoints still in the queue
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+        self.raise_error()
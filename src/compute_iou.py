@@ -5,6 +5,9 @@ import open3d as o3d
 
 from InterObject3D.interactive_adaptation import InteractiveSegmentationModel
 from data_loader import DataLoader
+from prefetch import Prefetcher
+from profiling import add_profile_args, get_profiler
+from metrics import StageTimer, timed_iter
 import utils
 
 def parseargs():
@@ -29,7 +32,16 @@ def parseargs():
                         help="Click area (default: 0.1)")
     parser.add_argument("-vs", "--voxel_size", default=0.05, type=float,
                         help="The size data points are converting to (default: 0.05)")
+    parser.add_argument("-f", "--data_format", default='pcd', choices=['pcd', 'scene'],
+                        help="Dataset format, .pcd files or memory-mapped columnar scenes (default: pcd)")
+    parser.add_argument("--scene_cache_mb", type=int, default=2048,
+                        help="Memory budget of the in-process cache of decoded scenes in MB (default: 2048)")
+    parser.add_argument("--crop_margin", type=float, default=0,
+                        help="Crop samples to the object's bounding box grown by this margin in meters (default: 0 = whole room)")
+    parser.add_argument("-p", "--prefetch", type=int, default=2,
+                        help="Number of samples prepared ahead of the model in a background thread (default: 2, 0 = no prefetching)")
     parser.add_argument("-v", "--verbose", action='store_true', default=False)
+    add_profile_args(parser)
 
     return parser.parse_args()
 
@@ -48,6 +60,14 @@ def main(args):
         click_area = args['click_area']
         del args['inseg_global']  # delete before printing
         voxel_size = args['voxel_size']
+        data_format = args['data_format'] if 'data_format' in args else 'pcd'
+        scene_cache_mb = args['scene_cache_mb'] if 'scene_cache_mb' in args else 2048
+        prefetch = args['prefetch'] if 'prefetch' in args else 2
+        crop_margin = args['crop_margin'] if 'crop_margin' in args else 0
+        profile = args['profile'] if 'profile' in args else False
+        profile_dir = args['profile_dir'] if 'profile_dir' in args else '../profile'
+        profile_schedule = args['profile_schedule'] if 'profile_schedule' in args else (5, 2, 5)
+        device = args['device'] if 'device' in args else None
     else:
         src_path = args.src_path
         model_path = args.model_path
@@ -62,13 +82,23 @@ def main(args):
         click_area = args.click_area
         del args.inseg_global  # delete before printing
         voxel_size = args.voxel_size
+        data_format = args.data_format if hasattr(args, 'data_format') else 'pcd'
+        scene_cache_mb = args.scene_cache_mb if hasattr(args, 'scene_cache_mb') else 2048
+        prefetch = args.prefetch if hasattr(args, 'prefetch') else 2
+        crop_margin = args.crop_margin if hasattr(args, 'crop_margin') else 0
+        profile = args.profile if hasattr(args, 'profile') else False
+        profile_dir = args.profile_dir if hasattr(args, 'profile_dir') else '../profile'
+        profile_schedule = args.profile_schedule if hasattr(args, 'profile_schedule') else (5, 2, 5)
+        device = args.device if hasattr(args, 'device') else None
     print(f'compute_iou args: {args}')
 
     utils.ensure_folder_exists(output_dir)
     # print('Args:', args) # Debug print only
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-    data_loader = DataLoader(src_path, click_area=click_area, normalize_colors=True, verbose=verbose, downsample=downsample, limit_to_one_object=limit_to_one_object)
+    data_loader = DataLoader(src_path, click_area=click_area, normalize_colors=True, verbose=verbose, downsample=downsample, limit_to_one_object=limit_to_one_object,
+                             data_format=data_format, scene_cache_mb=scene_cache_mb, crop_margin=crop_margin)
 
     print(f'{len(data_loader)} elements in data loader')
 
@@ -84,47 +114,53 @@ def main(args):
 
     i = 0
 
-    while True:
-        batch = data_loader.get_random_batch()
-        if not batch:
-            break
-        if verbose:
-            print(f'\nBatch {i}')
-        else:
-            if i % 50 == 0 and i != 0:
-                print('')
-            print(".", end="", flush=True)
-        coords, feats, labels = batch
-        coords = torch.tensor(coords).float().to(device)
-        feats = torch.tensor(feats).float().to(device)
-        labels = torch.tensor(labels).long().to(device)
-
-        pred, logits = inseg_model_class.prediction(feats.float(), coords.cpu().numpy(), inseg_global_model, device, voxel_size=voxel_size)
-        pred = torch.unsqueeze(pred, dim=-1)
-
-        iou = inseg_model_class.mean_iou(pred, labels).cpu()
-        if verbose:
-            if data_loader.last_class is not None:
-                print(f'class: {data_loader.last_class}')
-            print(f'iou: {iou}')
-
-        if i < max_imgs:
-            output_point_cloud = utils.get_output_point_cloud(coords, feats, labels, pred)
-            if show_3d:
-                o3d.visualization.draw_geometries([output_point_cloud])
-            utils.save_point_cloud_views(output_point_cloud, iou, i, output_dir, verbose)
+    # Samples are read and prepared in a background thread while the model runs,
+    # the thread and the profiler are stopped also when evaluation fails
+    timer = StageTimer()  # stages are profiler regions
+    with Prefetcher(data_loader.iterate_random_batches(), depth=prefetch) as prefetcher, \
+            get_profiler(profile, profile_dir, 'compute_iou', profile_schedule) as profiler:
+        for batch, last_class in timed_iter(prefetcher, timer, 'data'):
+            if verbose:
+                print(f'\nBatch {i}')
+            else:
+                if i % 50 == 0 and i != 0:
+                    print('')
+                print(".", end="", flush=True)
+            coords, feats, labels = batch
+            coords = torch.tensor(coords).float().to(device)
+            feats = torch.tensor(feats).float().to(device)
+            labels = torch.tensor(labels).long().to(device)
+
+            pred, logits = inseg_model_class.prediction(feats.float(), coords.cpu().numpy(), inseg_global_model, device, voxel_size=voxel_size)
+            pred = torch.unsqueeze(pred, dim=-1)
+
+            with timer.stage('iou'):
+                iou = inseg_model_class.mean_iou(pred, labels).cpu()
+            if verbose:
+                if last_class is not None:
+                    print(f'class: {last_class}')
+                print(f'iou: {iou}')
+
+            if i < max_imgs:
+                output_point_cloud = utils.get_output_point_cloud(coords, feats, labels, pred)
+                if show_3d:
+                    o3d.visualization.draw_geometries([output_point_cloud])
+                utils.save_point_cloud_views(output_point_cloud, iou, i, output_dir, verbose)
             
-        results.append(iou)
-        if data_loader.last_class is not None:
-            if not data_loader.last_class in results_classes.keys():
-                results_classes[data_loader.last_class] = []
-            results_classes[data_loader.last_class].append(iou)
+            results.append(iou)
+            if last_class is not None:
+                if not last_class in results_classes.keys():
+                    results_classes[last_class] = []
+                results_classes[last_class].append(iou)
    
-        if verbose:
-            if data_loader.last_class is not None:
-                print(f'Mean iou so far ({data_loader.last_class}): {sum(results_classes[data_loader.last_class]) / len(results_classes[data_loader.last_class])}')
-            print(f'Mean iou so far (total): {sum(results) / len(results)}')
-        i += 1
+            if verbose:
+                if last_class is not None:
+                    print(f'Mean iou so far ({last_class}): {sum(results_classes[last_class]) / len(results_classes[last_class])}')
+                print(f'Mean iou so far (total): {sum(results) / len(results)}')
+            i += 1
+            profiler.step()
+    print(f'\n{data_loader.scene_cache.stats()}')
+    print(prefetcher.stats())
 
     # print result mean
     if verbose:
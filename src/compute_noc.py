@@ -5,6 +5,9 @@ import open3d as o3d
 
 from InterObject3D.interactive_adaptation import InteractiveSegmentationModel
 from data_loader import DataLoader
+from prefetch import Prefetcher
+from profiling import add_profile_args, get_profiler
+from metrics import StageTimer, timed_iter
 import utils
 
 def main():
@@ -33,14 +36,24 @@ def main():
                         help="Minimum IOU treshold (default: 80%)")
     parser.add_argument("-vs", "--voxel_size", default=0.05, type=float,
                         help="The size data points are converting to (default: 0.05)")
+    parser.add_argument("-f", "--data_format", default='pcd', choices=['pcd', 'scene'],
+                        help="Dataset format, .pcd files or memory-mapped columnar scenes (default: pcd)")
+    parser.add_argument("--scene_cache_mb", type=int, default=2048,
+                        help="Memory budget of the in-process cache of decoded scenes in MB (default: 2048)")
+    parser.add_argument("--crop_margin", type=float, default=0,
+                        help="Crop samples to the object's bounding box grown by this margin in meters (default: 0 = whole room)")
+    parser.add_argument("-p", "--prefetch", type=int, default=2,
+                        help="Number of objects prepared ahead of the model in a background thread (default: 2, 0 = no prefetching)")
     
+    add_profile_args(parser)
     args = parser.parse_args()
 
     utils.ensure_folder_exists(args.output_dir)
     
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-    data_loader = DataLoader(args.src_path, click_area=args.click_area, normalize_colors=True, verbose=args.verbose, downsample=args.downsample, limit_to_one_object=args.limit_to_one_object, n_of_clicks=args.max_clicks)
+    data_loader = DataLoader(args.src_path, click_area=args.click_area, normalize_colors=True, verbose=args.verbose, downsample=args.downsample, limit_to_one_object=args.limit_to_one_object, n_of_clicks=args.max_clicks,
+                             data_format=args.data_format, scene_cache_mb=args.scene_cache_mb, crop_margin=args.crop_margin)
 
     print(f'{len(data_loader)} elements in data loader')
     
@@ -49,60 +62,61 @@ def main():
     results = []
     
     i = 0
-    
-    while True:
-        batch = data_loader.get_batch_with_clicks(1)
-        if not batch:
-            break
-        
-        for clicks in range(1, args.max_clicks+1):
-            # print(f'\nSegmented object no.: {i}')
 
-            if (clicks != 1):
-                batch = data_loader.get_batch_with_clicks(clicks)
-            coords, feats, labels = batch 
+    # Objects (sample without clicks and the click area of every click) are prepared in a background thread,
+    # the thread and the profiler are stopped also when evaluation fails. One profiler step is one object with all of its clicks
+    timer = StageTimer()  # stages are profiler regions
+    with Prefetcher(data_loader.iterate_objects(), depth=args.prefetch) as prefetcher, \
+            get_profiler(args.profile, args.profile_dir, 'compute_noc', args.profile_schedule) as profiler:
+        for coords, click_feats, labels, click_areas in timed_iter(prefetcher, timer, 'data'):
             coords = torch.tensor(coords).float().to(device)
-            feats = torch.tensor(feats).float().to(device)
             labels = torch.tensor(labels).long().to(device)
+        
+            for clicks in range(1, args.max_clicks+1):
+                # print(f'\nSegmented object no.: {i}')
 
-            pred, logits = inseg_model_class.prediction(feats.float(), coords.cpu().numpy(), inseg_global_model, device, voxel_size=args.voxel_size)
-            pred = torch.unsqueeze(pred, dim=-1)
+                # Add one more click to the clicks of the previous iteration
+                click_feats[click_areas[min(clicks, len(click_areas)) - 1], 3] = 1
+                feats = torch.tensor(click_feats).float().to(device)
 
-            iou = inseg_model_class.mean_iou(pred, labels).cpu()
-            # print(f'\niou: {iou}')
+                pred, logits = inseg_model_class.prediction(feats.float(), coords.cpu().numpy(), inseg_global_model, device, voxel_size=args.voxel_size)
+                pred = torch.unsqueeze(pred, dim=-1)
+
+                iou = inseg_model_class.mean_iou(pred, labels).cpu()
+                # print(f'\niou: {iou}')
             
-            if iou >= args.k_iou:
-                print(f'Segmented object no.: {i}')
-                print(f'iou: {iou}')
-                print(f'NOC: {clicks}')
+                if iou >= args.k_iou:
+                    print(f'Segmented object no.: {i}')
+                    print(f'iou: {iou}')
+                    print(f'NOC: {clicks}')
                 
-                results.append(clicks)
-                print(f'Mean NOC so far: {sum(results) / len(results)}\n')
+                    results.append(clicks)
+                    print(f'Mean NOC so far: {sum(results) / len(results)}\n')
                 
-                if i < args.max_imgs:
-                    output_point_cloud = utils.get_output_point_cloud(coords, feats, labels, pred)
-                    if args.show_3d:
-                        o3d.visualization.draw_geometries([output_point_cloud])
-                    utils.save_point_cloud_views(output_point_cloud, iou, i, args.output_dir, args.verbose)
+                    if i < args.max_imgs:
+                        output_point_cloud = utils.get_output_point_cloud(coords, feats, labels, pred)
+                        if args.show_3d:
+                            o3d.visualization.draw_geometries([output_point_cloud])
+                        utils.save_point_cloud_views(output_point_cloud, iou, i, args.output_dir, args.verbose)
                     
-                data_loader.next_random_batch()
-                break
-            elif (clicks == args.max_clicks):
-                if i < args.max_imgs:
-                    output_point_cloud = utils.get_output_point_cloud(coords, feats, labels, pred)
-                    if args.show_3d:
-                        o3d.visualization.draw_geometries([output_point_cloud])
-                    utils.save_point_cloud_views(output_point_cloud, iou, i, args.output_dir, args.verbose)
+                    break
+                elif (clicks == args.max_clicks):
+                    if i < args.max_imgs:
+                        output_point_cloud = utils.get_output_point_cloud(coords, feats, labels, pred)
+                        if args.show_3d:
+                            o3d.visualization.draw_geometries([output_point_cloud])
+                        utils.save_point_cloud_views(output_point_cloud, iou, i, args.output_dir, args.verbose)
                 
-                results.append(clicks)
-                data_loader.next_random_batch()
+                    results.append(clicks)
                 
-                print(f'Segmented object no.: {i}')
-                print(f'iou: {iou}')
+                    print(f'Segmented object no.: {i}')
+                    print(f'iou: {iou}')
                 
-                print(f'Mean NOC so far: {sum(results) / len(results)}\n')        
-        i += 1
-
+                    print(f'Mean NOC so far: {sum(results) / len(results)}\n')        
+            i += 1
+            profiler.step()
+    print(data_loader.scene_cache.stats())
+    print(prefetcher.stats())
     print(f'Mean NOC: {sum(results) / len(results)}')
     print(f'{args.k_iou},{sum(results) / len(results):.4f}', file=open(f'{args.output_dir}/../result.txt', 'a'))
 
@@ -1,65 +1,134 @@
 import open3d as o3d
 import os
+import re
 import argparse
+import warnings
+import multiprocessing
+from functools import partial
 import numpy as np
 
+from normals import estimate_normals
+
+
+def read_annotation(path):
+    # Every line of the annotation file is "x y z r g b", so the whole file is read at once
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        try:
+            data = np.fromfile(path, sep=" ")
+        except (ValueError, DeprecationWarning):
+            data = None
+
+    # Some of the original files contain stray characters, these are parsed line by line
+    if data is None or data.size % 6 != 0:
+        data = read_annotation_lines(path)
+
+    return data.reshape((-1, 6))
+
+
+def read_annotation_lines(path):
+    number = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+    rows = []
+    with open(path, "r", errors="ignore") as f:
+        for line in f:
+            values = number.findall(line)
+            if len(values) >= 6:
+                rows.append([float(value) for value in values[:6]])
+    return np.array(rows, dtype=np.float64).reshape((-1, 6))
+
+
+def merge_annotations(annotations):
+    # Takes ownership of annotations: objects are popped from the list as soon as they are copied
+    # into the room, so the list is empty afterwards (pass a copy to keep the objects).
+    # Size the whole room first, so every point is copied only once
+    # (appending point clouds one by one re-copies the growing room for every object)
+    starts = np.cumsum([0] + [len(data) for data in annotations])
+    size = starts[-1]
+
+    positions = np.empty((size, 3), dtype=np.float32)
+    colors = np.empty((size, 3), dtype=np.float32)
+    group = np.empty((size, 1), dtype=np.uint8)
+
+    # Objects are popped from the end, every one is still written to its place in the room
+    while annotations:
+        i = len(annotations) - 1
+        data = annotations.pop()
+        start, end = starts[i], starts[i + 1]
+
+        positions[start:end] = data[:, :3]
+        # Original file has RGB in [0, 255] range
+        # it need to be converted to [0, 1] range
+        colors[start:end] = data[:, 3:] / 255
+        # Group is stored as uint8 (values wrap around the same way as before)
+        group[start:end] = i % 256
+
+    # Build the point cloud at the end, tensors share memory with the buffers
+    pcd = o3d.t.geometry.PointCloud(o3d.core.Tensor.from_numpy(positions))
+    pcd.point.colors = o3d.core.Tensor.from_numpy(colors)
+    pcd.point.group = o3d.core.Tensor.from_numpy(group)
+    pcd.point.maskPositive = o3d.core.Tensor.from_numpy(np.zeros((size, 1), dtype=np.uint8))
+    pcd.point.maskNegative = o3d.core.Tensor.from_numpy(np.zeros((size, 1), dtype=np.uint8))
+
+    return pcd
+
+
+def read_area_annotations(area):
+    annotations = []
+    for filename in os.listdir(os.path.join(area, "Annotations")):
+        # skip .DS_Store file
+        if not filename.endswith(".txt"):
+            continue
+        annotations.append(read_annotation(os.path.join(area, "Annotations", filename)))
+    return annotations
 
-def process_dataset(src, dst):
-    # Create a list containing path of every area from dataset
-    areas = [f.path for f in os.scandir(src) if f.is_dir()]
-    areas = [f.path for subfolder in areas for f in os.scandir(subfolder) if f.is_dir()]
 
-    # Process each area
-    for i, area in enumerate(areas):
-        print(f"{i+1}/{len(areas)} - {area.split('/')[-2]}_{area.split('/')[-1]}")
+def get_area_name(area):
+    return f"{area.split('/')[-2]}_{area.split('/')[-1]}"
 
-        dst_path = os.path.join(dst, f"{area.split('/')[-2]}_{area.split('/')[-1]}.pcd")
 
-        # Skip if file already exists
-        if os.path.exists(dst_path):
-            print(f"\tFile already exists, skipping")
-            continue
+def process_area(area, dst, normals=None):
+    dst_path = os.path.join(dst, f"{get_area_name(area)}.pcd")
 
-        merged_pcd = o3d.t.geometry.PointCloud()
-        group = 0
+    # Skip if file already exists
+    if os.path.exists(dst_path):
+        return False
 
-        # Annotations
-        for filename in os.listdir(os.path.join(area, "Annotations")):
-            # skip .DS_Store file
-            if not filename.endswith(".txt"):
-                continue
+    # Annotations, every file is one object (group)
+    merged_pcd = merge_annotations(read_area_annotations(area))
 
-            # Read pointcloud (it needs to be o3d.io, o3d.t.io doesn't support loading from txt)
-            # o3d.t.geometry.PointCloud - [Open3D WARNING] The format of txt is not supported
-            pcd = o3d.io.read_point_cloud(os.path.join(area, "Annotations", filename),
-                                          format='xyzrgb')
+    # Calculate normals (skipped when normals is None, they can be computed later with normals.get_normals)
+    if normals is not None:
+        merged_pcd.point.normals = o3d.core.Tensor(
+            estimate_normals(merged_pcd.point.positions.numpy(), **normals))
 
-            # Original file has RGB in [0, 255] range
-            # it need to be converted to [0, 1] range
-            for i in range(len(pcd.points)):
-                pcd.colors[i] /= 255
+    # Save
+    o3d.t.io.write_point_cloud(dst_path, merged_pcd)
+    return True
 
-            # Convert it to o3d.t.geometry.PointCloud
-            pcd = o3d.t.geometry.PointCloud.from_legacy(pcd)
 
-            # Add group label and masks
-            size = len(pcd.point.positions)
+def process_area_with_name(area, dst, normals=None):
+    return area, process_area(area, dst, normals)
 
-            pcd.point.group = o3d.core.Tensor(
-                np.full((size, 1), group), o3d.core.uint8, o3d.core.Device("CPU:0"))
-            pcd.point.maskPositive = o3d.core.Tensor(
-                np.zeros((size, 1)), o3d.core.uint8, o3d.core.Device("CPU:0")).reshape((size, 1))
-            pcd.point.maskNegative = o3d.core.Tensor(
-                np.zeros((size, 1)), o3d.core.uint8, o3d.core.Device("CPU:0")).reshape((size, 1))
 
-            merged_pcd = pcd if group == 0 else merged_pcd + pcd
-            group += 1
+def process_dataset(src, dst, workers=1, normals=None):
+    # Create a list containing path of every area from dataset
+    areas = [f.path for f in os.scandir(src) if f.is_dir()]
+    areas = [f.path for subfolder in areas for f in os.scandir(subfolder) if f.is_dir()]
 
-        # Calculate normals
-        merged_pcd.estimate_normals()
+    # Rooms are independent, so they can be converted in separate processes
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    process = partial(process_area_with_name, dst=dst, normals=normals)
+    results = pool.imap_unordered(process, areas) if pool else map(process, areas)
 
-        # Save
-        o3d.t.io.write_point_cloud(dst_path, merged_pcd)
+    # Process each area
+    for i, (area, converted) in enumerate(results):
+        print(f"{i+1}/{len(areas)} - {get_area_name(area)}")
+        if not converted:
+            print(f"\tFile already exists, skipping")
+
+    if pool:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
@@ -68,7 +137,24 @@ if __name__ == "__main__":
                         help="Source path (default: ../dataset/Stanford3dDataset_v1.2)")
     parser.add_argument("-d", "--dst_path", default="../dataset/S3DIS_converted",
                         help="Destination path (default: ../dataset/S3DIS_converted)")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Number of rooms converted in parallel, every worker holds a whole room and its merged copy "
+                             "in memory (default: 4)")
+    parser.add_argument("-n", "--normals", default="eager", choices=["eager", "skip"],
+                        help="Compute normals during conversion (eager) or skip them, "
+                             "normals.get_normals then computes and caches them on first request (default: eager)")
+    parser.add_argument("--normals_max_nn", type=int, default=30,
+                        help="Maximum number of neighbors used for normal estimation (default: 30)")
+    parser.add_argument("--normals_radius", type=float, default=None,
+                        help="KD-tree search radius for normal estimation (default: None = KNN search only)")
+    parser.add_argument("--normals_chunks", type=int, default=1,
+                        help="Split every room into this many chunks for normal estimation, "
+                             "requires --normals_radius (default: 1)")
+    parser.add_argument("--normals_workers", type=int, default=1,
+                        help="Number of threads estimating normals of chunks in parallel (default: 1)")
     args = parser.parse_args()
+    if args.normals_chunks > 1 and args.normals_radius is None:
+        parser.error("--normals_chunks > 1 requires --normals_radius")
 
     if not os.path.exists(args.src_path):
         print("Source path does not exist")
@@ -76,4 +162,9 @@ if __name__ == "__main__":
     if not os.path.exists(args.dst_path):
         os.mkdir(args.dst_path)
 
-    process_dataset(args.src_path, args.dst_path)
+    normals = None
+    if args.normals == "eager":
+        normals = {"max_nn": args.normals_max_nn, "radius": args.normals_radius,
+                   "chunks": args.normals_chunks, "workers": args.normals_workers}
+
+    process_dataset(args.src_path, args.dst_path, args.workers, normals)
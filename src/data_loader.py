@@ -3,17 +3,120 @@ import open3d as o3d
 import pickle
 import random
 import time
-from collections import defaultdict
 
 import numpy as np
 import torch
 
+import scene_format
+import sampling_plan
+import voxelize
+from sampling_plan import SamplingPlan
+from scene_cache import SceneCache
+from spatial_index import SpatialIndex
+
 random.seed(time.time())
 
 
+def build_group_index(groups):
+    # Sort points by group once, every object is then a range [start, start + count) of order
+    groups = np.asarray(groups).reshape(-1)
+    order = np.argsort(groups, kind='stable')
+    values, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+    return values, order, starts, counts
+
+
+def get_contiguous_ranges(values, order, starts, counts):
+    # Objects whose points form one contiguous run get (start, end), other objects aren't included
+    first = order[starts]
+    last = order[starts + counts - 1]
+    contiguous = last - first + 1 == counts
+    return {int(value): (int(start), int(end + 1))
+            for value, start, end, is_contiguous in zip(values, first, last, contiguous) if is_contiguous}
+
+
+def scene_entry_nbytes(entry):
+    scene, index = entry
+    return sum(array.nbytes for array in scene.values()) + (index.nbytes if index is not None else 0)
+
+
+class EpochSampler(torch.utils.data.Sampler):
+    # Random order of the samples (all samples of the plan or an array of sample indices), the same for the same seed
+    # and epoch. Indices are handed out to torch DataLoader workers by the main process, so every sample is used once per epoch.
+    def __init__(self, samples, seed):
+        self.samples = np.arange(samples) if np.isscalar(samples) else np.asarray(samples)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        return iter(self.samples[np.random.default_rng([self.seed, self.epoch]).permutation(len(self.samples))].tolist())
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class VoxelBudgetBatchSampler(torch.utils.data.Sampler):
+    # Batches of samples in a random order (the same for the same seed and epoch), every batch is filled
+    # until the next sample would exceed voxel_budget voxels. Samples bigger than the whole budget are left out.
+    # samples is a boolean mask of samples to use (e.g. DataLoader.get_valid_samples), all samples by default.
+    def __init__(self, sample_voxels, voxel_budget, seed, samples=None):
+        self.sample_voxels = np.asarray(sample_voxels)
+        self.voxel_budget = voxel_budget
+        self.seed = seed
+        self.epoch = 0
+        in_budget = self.sample_voxels <= voxel_budget
+        if samples is not None:
+            in_budget[~samples] = True
+            self.samples = np.nonzero(samples & in_budget)[0]
+        else:
+            self.samples = np.nonzero(in_budget)[0]
+        self.skipped = int(np.sum(~in_budget))
+        self.batches = None  # batches of self.epoch, packed once per epoch
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.batches = None
+        self.epoch = epoch
+
+    def get_batches(self):
+        if self.batches is None:
+            self.batches = self.pack_batches()
+        return self.batches
+
+    def pack_batches(self):
+        order = self.samples[np.random.default_rng([self.seed, self.epoch]).permutation(len(self.samples))]
+        batches, batch, voxels = [], [], 0
+        for sample, sample_voxels in zip(order.tolist(), self.sample_voxels[order].tolist()):
+            if batch and voxels + sample_voxels > self.voxel_budget:
+                batches.append(batch)
+                batch, voxels = [], 0
+            batch.append(sample)
+            voxels += sample_voxels
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        return iter(self.get_batches())
+
+    def __len__(self):
+        return len(self.get_batches())
+
+
+def worker_init_fn(worker_id):
+    # torch seeds python's random and torch in every worker (base seed + worker id), NumPy is seeded the same way
+    seed = torch.utils.data.get_worker_info().seed
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+
 class DataLoader:
     def __init__(self, data_path, click_area=0.05, downsample=0, force=False, 
-                 verbose=True, normalize_colors=False, limit_to_one_object=False, voxel_size=0, n_of_clicks=0):
+                 verbose=True, normalize_colors=False, limit_to_one_object=False, voxel_size=0, n_of_clicks=0,
+                 data_format='pcd', scene_cache_mb=2048, precompute_clicks=False, crop_margin=0, quantize=False,
+                 with_points=False):
         self.data_path = data_path
         self.click_area = click_area
         self.downsample = downsample
@@ -22,14 +125,35 @@ class DataLoader:
         self.normalize_colors = normalize_colors
         self.voxel_size = voxel_size
         self.n_of_clicks = n_of_clicks
+        self.limit_to_one_object = limit_to_one_object
+        # 'pcd' reads .pcd files, 'scene' reads memory-mapped columnar scenes (see scene_format.py)
+        self.data_format = data_format
+        # Samples are cropped to the object's bounding box grown by crop_margin on every side (0 = whole room)
+        self.crop_margin = crop_margin
+        # Samples are voxelized at voxel_size by the loader (see quantize_sample)
+        self.quantize = quantize
+        # Quantized samples also have point labels and the voxel of every point (only for point-level metrics)
+        self.with_points = with_points
 
         assert os.path.exists(data_path), "Data path does not exist. Choose a valid path to a dataset."
+        assert data_format in ['pcd', 'scene'], f"Unknown data format: {data_format}"
+        assert not quantize or voxel_size > 0, "Quantization in the data loader needs voxel_size > 0"
+
+        # Decoded (and downsampled) scenes shared by all samples from the same room
+        self.scene_cache = SceneCache(scene_cache_mb * 1024**2, scene_entry_nbytes)
         
         self.selected_object = None
         self.last_class = None
 
-        # self.cache_path = os.path.join(data_path, "dataloader_cache")
-        self.cache_path = os.path.join(data_path, "dataloader_cache_ds" + str(downsample) + "_nc" + str(n_of_clicks) + ".pkl")
+        # Points inside the click area of every click of the plan (CSR: click i has
+        # click_area_points[click_area_offsets[i]:click_area_offsets[i + 1]]), see load_click_areas
+        self.click_area_offsets = self.click_area_points = None
+
+        # Cache name is a hash of every parameter that shapes the plan and of the source files,
+        # so runs with different settings (or after the data changed) never reuse each other's plan
+        files = self.list_files()
+        self.cache_key = sampling_plan.get_plan_key(self.get_plan_params(), files)
+        self.cache_path = os.path.join(data_path, "dataloader_cache_" + self.cache_key + ".npz")
 
         # Load from cache
         classes_path = os.path.join("..", "dataset", "classes.pkl")
@@ -38,135 +162,394 @@ class DataLoader:
         else:
             self.classes = None
 
-        if os.path.exists(self.cache_path):
-            if force:
-                os.remove(self.cache_path)
-            else:
-                self.data = self.load_from_cache(self.cache_path)
-                self.len = self.remaining_unique_elements()
-                return
+        # Order of samples and objects in the current epoch, drawing is moving a cursor
+        self.rng = np.random.default_rng()
+        self.sample_order = self.object_order = None
+        self.sample_cursor = self.object_cursor = 0
+
+        if os.path.exists(self.cache_path) and force:
+            os.remove(self.cache_path)
+        if not os.path.exists(self.cache_path):
+            self.build_plan(files)
+        elif not self.load_plan():
+            print('DataLoader cache is outdated, rebuilding it.')
+            self.build_plan(files)
+
+        if precompute_clicks:
+            self.load_click_areas()
+
+        self.new_epoch()
+        self.len = self.remaining_unique_elements()
 
-        self.data = {}
+    def build_plan(self, files):
+        plan_objects = []
 
-        print(f'\nCreating DataLoader with click_area={click_area} and downsample={downsample} and n of clicks={n_of_clicks}, processing {len([f for f in os.scandir(data_path)])} files.')
+        print(f'\nCreating DataLoader with click_area={self.click_area} and downsample={self.downsample} and n of clicks={self.n_of_clicks}, processing {len(files)} files.')
         # Process each area
-        for i, file in enumerate([f.path for f in os.scandir(data_path) if f.path.endswith('.pcd')]):
-            if verbose:
+        for i, file in enumerate(files):
+            if self.verbose:
                 print(f"Processing {file}")
             else:
                 if i % 50 == 0 and i != 0:
                     print('')
                 print(".", end="", flush=True)
-            self.data[file] = []
 
             # Load pointcloud and split into groups (objects)
-            pcd = o3d.t.io.read_point_cloud(file)
-            
-            if downsample != 0:
-                pcd = pcd.uniform_down_sample(every_k_points=downsample)
-                
-            groups = list(pcd.point.group.flatten().numpy())
-            groups = list(defaultdict(list, {val: [i for i, v in enumerate(groups) if v == val] for val in set(groups)}).values())
+            scene = self.read_scene(file)
+            values, order, starts, counts = build_group_index(scene['group'])
+            objects = list(range(len(starts)))
+            ranges = get_contiguous_ranges(values, order, starts, counts)
 
-            if limit_to_one_object:
-                groups = [random.choice(groups)]
+            if self.limit_to_one_object:
+                objects = [random.choice(objects)]
                 
             # Simulate clicked points for each group
-            for group in groups:     
+            for obj in objects:
+                # Point indices of the object (ascending)
+                group = order[starts[obj]:starts[obj] + counts[obj]]
+
                 # Select every k point from each object
                 # First and last point are skipped
                 
                 if self.n_of_clicks == 0:
-                    points = [group[(i * (len(group) // 11))] for i in range(1, 10)]
+                    points = group[np.arange(1, 10) * (len(group) // 11)].tolist()
                     random.shuffle(points)
                     # groups of 1,1,2,2,3 clicks
                     points = [points[0:1], points[1:2], points[2:4], points[4:6], points[6:9]]
                     random.shuffle(points)
                 else:
-                    points = [[group[(i * (len(group) // (self.n_of_clicks + 2)))]] for i in range(1, self.n_of_clicks + 1)]
+                    points = [[point] for point in group[np.arange(1, self.n_of_clicks + 1) * (len(group) // (self.n_of_clicks + 2))].tolist()]
                     random.shuffle(points)
-                self.data[file].append(points)
-                
-            random.shuffle(self.data[file])
+                object_positions = scene['positions'][group]
+                plan_objects.append({'scene': i, 'group': values[obj], 'range': ranges.get(int(values[obj])),
+                                     'bbox': (object_positions.min(axis=0), object_positions.max(axis=0)),
+                                     'samples': points})
             
         print('')
 
-        self.len = self.remaining_unique_elements()
+        self.plan = SamplingPlan.from_objects(files, plan_objects)
+        print(self.plan.stats())
 
         # Save to cache
-        with open(self.cache_path, 'wb') as f:
-            pickle.dump(self.data, f)
+        sampling_plan.save_plan(self.cache_path, self.plan, self.cache_key, self.get_plan_params())
 
     def __getitem__(self, index):
-        return self.get_random_batch()
+        # Sample of the plan with the given index, doesn't touch the epoch order so it's safe in torch DataLoader workers
+        return self.process_sample(index)
     
-    def process_click(self, points, area):
+    def list_files(self):
+        if self.data_format == 'scene':
+            return sorted(f.path for f in os.scandir(self.data_path) if scene_format.is_scene(f.path))
+        return sorted(f.path for f in os.scandir(self.data_path) if f.path.endswith('.pcd'))
+
+    def get_plan_params(self):
+        return {'downsample': self.downsample, 'n_of_clicks': self.n_of_clicks,
+                'limit_to_one_object': self.limit_to_one_object, 'data_format': self.data_format}
+
+    def read_scene(self, file):
+        # Positions, colors and group of a (downsampled) scene as read-only NumPy arrays
+        if self.data_format == 'scene':
+            # Memory-mapped columns, downsampling is only a strided view
+            scene = scene_format.read_scene(file).downsample(self.downsample)
+            positions, colors, group = scene.positions, scene.float_colors(), scene.group
+        else:
+            pcd = o3d.t.io.read_point_cloud(file)
+            if self.downsample != 0:
+                pcd = pcd.uniform_down_sample(every_k_points=self.downsample)
+            positions, colors, group = pcd.point.positions.numpy(), pcd.point.colors.numpy(), pcd.point.group.numpy()
+
+        scene = {'positions': positions, 'colors': colors, 'group': np.asarray(group).reshape(-1)}
+        for array in scene.values():
+            array.setflags(write=False)
+        return scene
+
+    def read_scene_entry(self, area):
+        # Scene and its spatial index for click areas, both are built once per scene
+        # (no index with precomputed click areas, samples then don't search for neighbors)
+        scene = self.read_scene(area)
+        if self.click_area_offsets is not None:
+            return scene, None
+        return scene, SpatialIndex(scene['positions'], self.click_area)
+
+    def load_plan_arrays(self, name, names, build):
+        # Arrays derived from the plan are stored next to it, keyed by the plan's clicks and by name
+        # (which contains the parameters they depend on)
+        key = f'{self.plan.digest()}_{name}'
+        path = os.path.join(self.data_path, f"dataloader_cache_{self.cache_key}_{name}.npz")
+        loaded = sampling_plan.load_arrays(path, key, names) if os.path.exists(path) else None
+        if loaded is not None:
+            return loaded[1]
+
+        arrays = build()
+        sampling_plan.save_arrays(path, arrays, {'key': key})
+        return arrays
+
+    def load_click_areas(self):
+        arrays = self.load_plan_arrays(f'clicks_{self.click_area}', ('offsets', 'points'), self.build_click_areas)
+        self.click_area_offsets, self.click_area_points = arrays['offsets'], arrays['points']
+        self.scene_cache.clear()
+        nbytes = self.click_area_offsets.nbytes + self.click_area_points.nbytes
+        print(f'click areas: {len(self.click_area_offsets) - 1} clicks, {len(self.click_area_points)} points, {nbytes / 1024**2:.2f} MB')
+
+    def build_click_areas(self):
+        print(f'Precomputing click areas with click_area={self.click_area}')
+        click_scenes = self.plan.get_click_scenes()
+        click_areas = [None] * len(click_scenes)
+        for scene_id in np.unique(click_scenes):
+            print(".", end="", flush=True)
+            scene = self.read_scene(self.plan.files[scene_id])
+            clicks = np.nonzero(click_scenes == scene_id)[0]
+            index = SpatialIndex(scene['positions'], self.click_area)
+            areas = index.query_radius(scene['positions'][self.plan.click_points[clicks]], self.click_area)
+            for click, area in zip(clicks, areas):
+                click_areas[click] = area
+        print('')
+
+        counts = np.array([len(area) for area in click_areas], dtype=np.int64)
+        points = np.concatenate(click_areas) if click_areas else np.zeros(0)
+        return {'offsets': np.concatenate(([0], np.cumsum(counts))), 'points': points.astype(np.int32)}
+
+    def load_scene(self, area):
+        # Cached scene is shared read-only, masks and features are built on per-sample copies
+        return self.scene_cache.get((area, self.downsample), lambda: self.read_scene_entry(area))
+
+    def get_sample_voxels(self):
+        # Number of voxels of every sample at voxel_size (before clicks and features are reduced, so exact)
+        assert self.voxel_size > 0, "Voxel counts need voxel_size > 0"
+        arrays = self.load_plan_arrays(f'voxels_{self.voxel_size}_crop{self.crop_margin}', ('object_voxels',), self.count_voxels)
+        return arrays['object_voxels'][self.plan.sample_object]
+
+    def count_voxels(self):
+        print(f'Counting voxels of samples with voxel_size={self.voxel_size}')
+        object_voxels = np.zeros(self.plan.n_objects, dtype=np.int64)
+        for scene_id in np.unique(self.plan.object_scene):
+            print(".", end="", flush=True)
+            positions = self.read_scene(self.plan.files[scene_id])['positions']
+            objects = np.nonzero(self.plan.object_scene == scene_id)[0]
+            if self.crop_margin > 0:
+                for obj in objects:
+                    object_voxels[obj] = len(voxelize.quantize(positions[self.get_crop(positions, obj)], self.voxel_size)[0])
+            else:
+                # Every object's sample is the whole scene
+                object_voxels[objects] = len(voxelize.quantize(positions, self.voxel_size)[0])
+        print('')
+        return {'object_voxels': object_voxels}
+
+    def get_valid_samples(self, min_foreground=0.004):
+        # Samples whose clicks survive quantization at voxel_size and whose object has at least min_foreground
+        # of the sample's voxels, the same conditions train.clicks_in_sinput and train.labels_in_sinput check on batches
+        assert self.voxel_size > 0, "Sample checks need voxel_size > 0"
+        name = f'sample_checks_{self.voxel_size}_{self.click_area}_crop{self.crop_margin}' + ('_quantized' if self.quantize else '')
+        arrays = self.load_plan_arrays(name, ('object_foreground', 'sample_clicks'), self.check_samples)
+
+        foreground = arrays['object_foreground'][self.plan.sample_object] >= min_foreground
+        clicks = arrays['sample_clicks']
+        valid = foreground & clicks
+        print(f'sample checks: {np.sum(~valid)} of {len(valid)} samples are not valid, '
+              f'{np.sum(~clicks)} without surviving clicks, {np.sum(~foreground)} with less than {min_foreground * 100:.1f}% foreground voxels')
+        return valid
+
+    def check_samples(self):
+        # Checks run on the voxels of the sample itself (the crop when cropping) with the reduction the training step
+        # gets. When the loader quantizes, a voxel is clicked when any of its points is and its label is the majority
+        # label (quantize_sample), so both checks are exact. Otherwise ME keeps a random point of every voxel:
+        # foreground is the expected share of object voxels and clicks survive when at least one clicked voxel is kept
+        # with a probability of at least one half.
+        print(f'Checking samples with voxel_size={self.voxel_size}')
+        plan = self.plan
+        object_foreground = np.zeros(plan.n_objects, dtype=np.float64)
+        sample_clicks = np.zeros(plan.n_samples, dtype=bool)
+
+        for scene_id in np.unique(plan.object_scene):
+            print(".", end="", flush=True)
+            scene = self.read_scene(plan.files[scene_id])
+            positions, groups = scene['positions'], scene['group']
+            index = SpatialIndex(positions, self.click_area) if self.click_area_offsets is None else None
+            if self.crop_margin <= 0:
+                _, _, scene_inverse, scene_counts = voxelize.quantize(positions, self.voxel_size)
+
+            for obj in np.nonzero(plan.object_scene == scene_id)[0]:
+                crop, object_range = self.get_crop_range(positions, obj)
+                if crop is None:
+                    inverse, counts = scene_inverse, scene_counts
+                else:
+                    _, _, inverse, counts = voxelize.quantize(positions[crop], self.voxel_size)
+                if len(counts) == 0:
+                    continue
+
+                label = self.get_label(groups if crop is None else groups[crop], plan.object_group[obj], object_range)
+                object_counts = np.bincount(inverse, weights=label.reshape(-1), minlength=len(counts))
+                if self.quantize:
+                    object_foreground[obj] = np.sum(2 * object_counts > counts) / len(counts)
+                else:
+                    object_foreground[obj] = np.sum(object_counts / counts) / len(counts)
+
+                for sample in range(plan.object_offsets[obj], plan.object_offsets[obj + 1]):
+                    start, end = plan.get_sample_clicks(sample)
+                    clicked_points = np.unique(self.to_crop(crop, self.get_click_mask(index, positions, start, end)))
+                    voxels, clicked = np.unique(inverse[clicked_points], return_counts=True)
+                    if self.quantize:
+                        sample_clicks[sample] = len(voxels) > 0
+                    else:
+                        sample_clicks[sample] = len(voxels) > 0 and np.prod(1 - clicked / counts[voxels]) <= 0.5
+        print('')
+        return {'object_foreground': object_foreground, 'sample_clicks': sample_clicks}
+
+    def get_click_mask(self, index, positions, start, end):
+        # Indices of all points inside the click areas of clicks start:end of the plan (one batched query and scatter)
+        if self.click_area_offsets is not None:
+            # Precomputed click areas of consecutive clicks are one slice, duplicates don't matter for the scatter
+            return self.click_area_points[self.click_area_offsets[start]:self.click_area_offsets[end]]
+        return index.query_radius_union(positions[self.plan.click_points[start:end]], self.click_area)
+
+    def get_click_areas(self, index, positions, start, end):
+        # Click area of every click start:end of the plan
+        if self.click_area_offsets is not None:
+            offsets = self.click_area_offsets
+            return [self.click_area_points[offsets[click]:offsets[click + 1]] for click in range(start, end)]
+        return index.query_radius(positions[self.plan.click_points[start:end]], self.click_area)
+
+    def process_sample(self, sample):
+        start, end = self.plan.get_sample_clicks(sample)
+        return self.process_click(self.plan.sample_object[sample], start, end)
+
+    def process_click(self, obj, start, end):
+        # Sample of an object with clicks start:end of the plan
+        area = self.plan.files[self.plan.object_scene[obj]]
+        points = self.plan.click_points[start:end]
+
         # Load pointcloud
-        pcd = o3d.t.io.read_point_cloud(area)
-        if self.downsample != 0:
-            pcd = pcd.uniform_down_sample(every_k_points=self.downsample)
-        
-    
-        # Create a copy of the pointcloud (KDTreeFlann doesn't support o3d.t.geometry.PointCloud or idk)
-        # It's ugly but it works
-        pcd_tree = o3d.geometry.PointCloud()
-        pcd_tree.points = o3d.utility.Vector3dVector(pcd.point.positions.numpy())
-        tree = o3d.geometry.KDTreeFlann(pcd_tree)
-    
-        # Create a click area for each simulated point
-        for point in points:
-            [_, idx, _] = tree.search_radius_vector_3d(pcd_tree.points[point], self.click_area)
-            for i in idx:
-                pcd.point.maskPositive[i] = 1
+        scene, index = self.load_scene(area)
+        coords, feats, label, crop = self.prepare_sample(scene, area, obj, points[0])
+        feats[self.to_crop(crop, self.get_click_mask(index, scene['positions'], start, end)), 3] = 1
+
+        if self.verbose:
+            print(f"Simulated click - {area.split('/')[-1]}/object {scene['group'][points[0]]}/point {points}")
+
+        if self.quantize:
+            return self.quantize_sample(coords, feats, label)
+
+        # Return the concatenated arrays
+        return coords, feats, label
 
+    def quantize_sample(self, coords, feats, label):
+        # Voxel coordinates (coords are already divided by voxel_size), mean color, a voxel is clicked when any of its
+        # points is clicked and its label is the majority label. With with_points, point labels and the voxel of every
+        # point are returned too for point-level metrics, otherwise only voxels leave the worker.
+        voxel_coords, _, inverse, counts = voxelize.quantize(coords, 1)
+        n_voxels = len(voxel_coords)
+
+        voxel_feats = np.zeros((n_voxels, feats.shape[1]), dtype=np.float32)
+        voxel_feats[:, :3] = voxelize.mean_per_voxel(feats[:, :3], inverse, counts)
+        for column in range(3, feats.shape[1]):
+            voxel_feats[:, column] = voxelize.any_per_voxel(feats[:, column], inverse, n_voxels)
+        voxel_label = voxelize.majority_per_voxel(label, inverse, n_voxels).reshape((-1, 1))
+
+        voxel_sample = voxel_coords.astype(np.int32), voxel_feats, voxel_label
+        if not self.with_points:
+            return voxel_sample
+        return voxel_sample + (label.reshape(-1), inverse.astype(np.int32))
+
+    def get_object_sample(self, obj):
+        # Sample of an object without clicks and the click area of every click of the object (in order),
+        # the caller adds clicks one by one with feats[click_areas[i], 3] = 1 (NOC)
+        area = self.plan.files[self.plan.object_scene[obj]]
+        scene, index = self.load_scene(area)
+        start, end = self.plan.get_object_clicks(obj, self.n_of_clicks)
+        coords, feats, label, crop = self.prepare_sample(scene, area, obj, self.plan.click_points[start])
+        click_areas = [self.to_crop(crop, click_area) for click_area in self.get_click_areas(index, scene['positions'], start, end)]
+        return coords, feats, label, click_areas
+
+    def iterate_random_batches(self):
+        # Remaining samples of the epoch together with their class, for a prefetcher in another thread
+        while True:
+            batch = self.get_random_batch()
+            if batch is None:
+                return
+            yield batch, self.last_class
+
+    def iterate_objects(self):
+        # Remaining objects of the epoch, see get_object_sample
+        while True:
+            self.next_random_batch()
+            if self.selected_object is None:
+                return
+            yield self.get_object_sample(self.selected_object)
+
+    def prepare_sample(self, scene, area, obj, point):
+        # Coordinates, features without clicks and label of a sample, and the indices of the points
+        # of the scene kept in the crop (None without cropping)
+        positions, colors, groups = scene['positions'], scene['colors'], scene['group']
+        crop, object_range = self.get_crop_range(positions, obj)
+        if crop is not None:
+            positions, colors, groups = positions[crop], colors[crop], groups[crop]
 
         # Get group id for label
-        group = pcd.point.group[points].numpy()[0]
+        group = scene['group'][point]
         
         if self.classes:
-            self.last_class = self.classes[area.split('/')[-1]][group[0]]
+            # Classes are stored under the name of the original .pcd file
+            self.last_class = self.classes[os.path.splitext(os.path.basename(area))[0] + '.pcd'][group]
 
         # Create a mask with the same group as the clicked point
-        label = (pcd.point.group.numpy() == group)
-        label = o3d.core.Tensor(label, o3d.core.uint8, o3d.core.Device("CPU:0")).numpy() #(dtype=np.int8)
+        label = self.get_label(groups, group, object_range)
 
         # Add tuple of pointcloud and label to batch
-        coords = pcd.point.positions.numpy()
-        if self.voxel_size > 0:
-            coords = coords / self.voxel_size
+        coords = positions / self.voxel_size if self.voxel_size > 0 else np.array(positions)
 
-        feats = np.concatenate((pcd.point.colors.numpy(), pcd.point.maskPositive.numpy(), pcd.point.maskNegative.numpy()), axis=1, dtype=np.float32)
+        # Features are colors, maskPositive and maskNegative, masks are owned by the sample (not the cached scene)
+        feats = np.zeros((len(positions), 5), dtype=np.float32)
+        feats[:, :3] = colors
         if self.normalize_colors:
             feats[:, :3] = feats[:, :3] / 255
 
-        if self.verbose:
-            print(f"Simulated click - {area.split('/')[-1]}/object {group}/point {points}")
+        return coords, feats, label, crop
+
+    def get_crop_range(self, positions, obj):
+        # Crop of the object (None without cropping) and the object's range of points in it (None if not contiguous)
+        object_range = self.plan.get_range(obj)
+        if self.crop_margin <= 0:
+            return None, object_range
+        crop = self.get_crop(positions, obj)
+        if object_range is not None:
+            # The whole object is inside the crop and stays contiguous
+            object_range = tuple(int(i) for i in np.searchsorted(crop, object_range))
+        return crop, object_range
+
+    def get_crop(self, positions, obj):
+        # Indices (ascending) of the points inside the object's bounding box grown by crop_margin
+        low, high = self.plan.object_bbox[obj]
+        inside = np.all((positions >= low - self.crop_margin) & (positions <= high + self.crop_margin), axis=1)
+        return np.nonzero(inside)[0]
 
-        # Return the concatenated arrays
-        return coords, feats, label
+    @staticmethod
+    def to_crop(crop, indices):
+        # Point indices of the scene to indices in the crop, points outside of the crop are dropped
+        if crop is None:
+            return indices
+        found = np.minimum(np.searchsorted(crop, indices), len(crop) - 1)
+        return found[crop[found] == indices]
+
+    def get_label(self, groups, group, object_range=None):
+        # Objects written one after another by convert_dataset are contiguous, their label is a slice
+        if object_range is not None:
+            start, end = object_range
+            label = np.zeros((len(groups), 1), dtype=np.uint8)
+            label[start:end] = 1
+            return label
+
+        return (groups == group).astype(np.uint8).reshape((-1, 1))
 
     def get_random_batch(self):
         # return random area/object every function call
-        if not self.data:
+        if self.sample_cursor >= len(self.sample_order):
             # Every point has been processed
             print("DataLoader: All points have been processed. Returning None.")
             return None
-                
-        # Select random area, object and point
-        random_area = random.choice(list(self.data.keys()))
-        random_object = random.randint(0, len(self.data[random_area])-1)
-
-        random_points = self.data[random_area][random_object].pop(0)
-
-        # Remove already simulated point from data
-        if not self.data[random_area][random_object]:
-            del self.data[random_area][random_object]
-            if not self.data[random_area]:
-                del self.data[random_area]
-        else:                
-            random.shuffle(self.data[random_area])
-            
-        return self.process_click(random_points, random_area)
+
+        sample = self.sample_order[self.sample_cursor]
+        self.sample_cursor += 1
+        return self.process_sample(sample)
     
     def get_batch_with_clicks(self, n_of_clicks):
         # return same area/object every function call
@@ -180,26 +563,16 @@ class DataLoader:
         if n_of_clicks > self.n_of_clicks:
             n_of_clicks = self.n_of_clicks
             
-        points = [point for points in self.selected_object[:n_of_clicks] for point in points]
-        return self.process_click(points, self.selected_area)
+        start, end = self.plan.get_object_clicks(self.selected_object, n_of_clicks)
+        return self.process_click(self.selected_object, start, end)
     
     def next_random_batch(self):
-        if not self.data:
+        if self.object_cursor >= len(self.object_order):
             self.selected_object = None
             return
-        
-        # Select random area, object and point
-        random_area = random.choice(list(self.data.keys()))
-        random_object = random.randint(0, len(self.data[random_area])-1)
 
-        self.selected_object = self.data[random_area][random_object]
-        self.selected_area = random_area
-
-        del self.data[random_area][random_object]
-        if not self.data[random_area]:
-            del self.data[random_area]
-        else:                
-            random.shuffle(self.data[random_area])
+        self.selected_object = self.object_order[self.object_cursor]
+        self.object_cursor += 1
 
     def list_to_batch(self, clouds, dtype):
         max_len = max([len(cloud) for cloud in clouds])
@@ -209,11 +582,24 @@ class DataLoader:
         return torch.tensor(batch, dtype=dtype)
 
     def new_epoch(self):
-        assert os.path.exists(self.cache_path), "Cache not found."
-        self.data = self.load_from_cache(self.cache_path)
+        # Reshuffle in memory, the plan itself (and the simulated clicks) stays the same
+        self.sample_order = self.rng.permutation(self.plan.n_samples)
+        self.object_order = self.rng.permutation(self.plan.n_objects)
+        self.sample_cursor = self.object_cursor = 0
+        self.selected_object = None
+
+    def load_plan(self):
+        print(f'Loading data from cache: {self.cache_path}')
+        plan = sampling_plan.load_plan(self.cache_path, self.cache_key)
+        if plan is None:
+            return False
+
+        self.plan = plan
+        print(self.plan.stats())
+        return True
 
     def remaining_unique_elements(self):
-        return sum(len(area) for areas in self.data.values() for area in areas)
+        return len(self.sample_order) - self.sample_cursor
 
     def __len__(self):
         return self.len
@@ -1,28 +1,107 @@
 import open3d as o3d
 import os
 import argparse
+import multiprocessing
+from functools import partial
 import numpy as np
 
+import voxelize
 
-def downsample_dataset(src, dst, value):
-    areas = [f.path for f in os.scandir(src) if f.path.endswith(".pcd")]
-    for i, area in enumerate(areas):
-        print(f"{i+1}/{len(areas)} - {area.split('/')[-1]}")
-        
-        pcd = o3d.t.io.read_point_cloud(area)
-        pcd = pcd.uniform_down_sample(every_k_points=value)
-        
+
+SPLITS = ["train", "test", "val"]
+
+
+def get_split_folder(file_name):
+    # Area_5 is used for testing, Area_6 for validation, the rest for training
+    area_number = file_name[5]
+    if area_number == "5":
+        return "test"
+    elif area_number == "6":
+        return "val"
+    return "train"
+
+
+def get_levels(every_k_values, voxel_sizes):
+    # Every level is (folder name, method, value)
+    levels = [(f"k{k}", "every_k", k) for k in every_k_values]
+    levels += [(f"voxel{voxel_size}", "voxel", voxel_size) for voxel_size in voxel_sizes]
+    return levels
+
+
+def get_level_path(dst, levels, level_name):
+    # One level is written straight to dst (original layout), more levels form a pyramid dst/<level>/
+    return dst if len(levels) == 1 else os.path.join(dst, level_name)
+
+
+def voxel_down_sample(pcd, voxel_size):
+    # One point per occupied voxel (voxels are aligned the same way as in MinkowskiEngine),
+    # so the number of points matches the number of voxels the model gets with the same voxel_size
+    positions = pcd.point.positions.numpy()
+    _, _, inverse, counts = voxelize.quantize(positions, voxel_size)
+    n_voxels = len(counts)
+
+    # Positions and colors are averaged, group is the majority of the voxel and masks are OR-ed
+    voxel_pcd = o3d.t.geometry.PointCloud(o3d.core.Tensor(
+        voxelize.mean_per_voxel(positions, inverse, counts).astype(positions.dtype)))
+    colors = pcd.point.colors.numpy()
+    voxel_pcd.point.colors = o3d.core.Tensor(
+        voxelize.mean_per_voxel(colors, inverse, counts).astype(colors.dtype))
+    group = pcd.point.group.numpy()
+    voxel_pcd.point.group = o3d.core.Tensor(
+        voxelize.majority_per_voxel(group, inverse, n_voxels).reshape((n_voxels, 1)))
+
+    for mask in ["maskPositive", "maskNegative"]:
+        if mask in pcd.point:
+            voxel_pcd.point[mask] = o3d.core.Tensor(
+                voxelize.any_per_voxel(pcd.point[mask].numpy(), inverse, n_voxels)
+                .astype(pcd.point[mask].numpy().dtype).reshape((n_voxels, 1)))
+
+    return voxel_pcd
+
+
+def downsample_area(area, dst, levels):
+    name = area.split('/')[-1]
+
+    # Read every room only once and write all levels from it
+    pcd = o3d.t.io.read_point_cloud(area)
+    if "normals" in pcd.point:
         del pcd.point.normals
-        
-        area_number = area.split('/')[-1][5]
-        if area_number == 5:
-            folder = "test"
-        elif area_number == 6:
-            folder = "val"
+
+    for level_name, method, value in levels:
+        if method == "voxel":
+            downsampled = voxel_down_sample(pcd, value)
         else:
-            folder = "train"
-        
-        o3d.t.io.write_point_cloud(os.path.join(dst, folder, area.split('/')[-1]), pcd)
+            downsampled = pcd.uniform_down_sample(every_k_points=value)
+
+        level_path = get_level_path(dst, levels, level_name)
+        o3d.t.io.write_point_cloud(os.path.join(level_path, get_split_folder(name), name), downsampled)
+
+    return name
+
+
+def downsample_dataset(src, dst, value, voxel_sizes=(), workers=1):
+    # value is one every-k factor or a list of them
+    every_k_values = list(value) if isinstance(value, (list, tuple)) else [value] if value else []
+    levels = get_levels(every_k_values, voxel_sizes)
+
+    for level_name, _, _ in levels:
+        for split in SPLITS:
+            os.makedirs(os.path.join(get_level_path(dst, levels, level_name), split), exist_ok=True)
+
+    areas = [f.path for f in os.scandir(src) if f.path.endswith(".pcd")]
+
+    # Rooms are independent, so they can be processed in separate processes
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    process = partial(downsample_area, dst=dst, levels=levels)
+    results = pool.imap_unordered(process, areas) if pool else map(process, areas)
+
+    for i, name in enumerate(results):
+        print(f"{i+1}/{len(areas)} - {name}")
+
+    if pool:
+        pool.close()
+        pool.join()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -30,19 +109,24 @@ if __name__ == "__main__":
                         help="Source path (default: ../dataset/S3DIS_converted")
     parser.add_argument("-d", "--dst_path", default="../dataset/S3DIS_converted_downsampled",
                         help="Destination path (default: ../dataset/S3DIS_converted_downsampled)")
-    parser.add_argument("-k", "--downsample_value", type=int, default=5, help="Value for downsampling, every k point (default: 5)")
+    parser.add_argument("-k", "--downsample_value", type=int, nargs="*", default=None,
+                        help="Values for downsampling, every k point (default: 5). "
+                             "More values (or voxel sizes) are written as a pyramid, one subfolder per level")
+    parser.add_argument("-vs", "--voxel_sizes", type=float, nargs="*", default=[],
+                        help="Voxel sizes for voxel grid downsampling levels, use the --voxel_size of training "
+                             "to get one point per model voxel (default: none)")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of rooms processed in parallel (default: 1)")
     args = parser.parse_args()
+    if args.downsample_value == [] and not args.voxel_sizes:
+        parser.error("-k/--downsample_value needs at least one value when no --voxel_sizes are given")
 
     if not os.path.exists(args.src_path):
         print("Source path does not exist")
         exit(1)
-    if not os.path.exists(args.dst_path):
-        os.mkdir(args.dst_path)
-    if not os.path.exists(os.path.join(args.dst_path, "train")):
-        os.mkdir(os.path.join(args.dst_path, "train"))
-    if not os.path.exists(os.path.join(args.dst_path, "test")):
-        os.mkdir(os.path.join(args.dst_path, "test"))
-    if not os.path.exists(os.path.join(args.dst_path, "val")):
-        os.mkdir(os.path.join(args.dst_path, "val"))
-
-    downsample_dataset(args.src_path, args.dst_path, args.downsample_value)
+
+    every_k_values = args.downsample_value
+    if every_k_values is None:
+        every_k_values = [] if args.voxel_sizes else [5]
+
+    downsample_dataset(args.src_path, args.dst_path, every_k_values, args.voxel_sizes, args.workers)
@@ -8,6 +8,7 @@ import os
 
 import torch
 from InterObject3D.interactive_adaptation import InteractiveSegmentationModel
+from spatial_index import SpatialIndex
 
 
 class Interactive:
@@ -16,6 +17,7 @@ class Interactive:
         self.model_path_ours = model_path_ours
         self.model_path_io3d = model_path_io3d
         self.fix = fix
+        self.index = None
         self.initGUI()
         self.initApp()
 
@@ -47,12 +49,14 @@ class Interactive:
 
         self.areaPositive = gui.NumberEdit(gui.NumberEdit.DOUBLE)
         self.areaPositive.double_value = 0.05
+        self.areaPositive.set_on_value_changed(self.onAreaChange)
         gridP = gui.VGrid(2, 5)
         gridP.add_child(gui.Label("Click area (positive) \t"))
         gridP.add_child(self.areaPositive)
 
         self.areaNegative = gui.NumberEdit(gui.NumberEdit.DOUBLE)
         self.areaNegative.double_value = 0.05
+        self.areaNegative.set_on_value_changed(self.onAreaChange)
         gridN = gui.VGrid(2, 5)
         gridN.add_child(gui.Label("Click area (negative)\t"))
         gridN.add_child(self.areaNegative)
@@ -283,6 +287,7 @@ class Interactive:
             o3d.core.Device("CPU:0")
         )
 
+        self.buildIndex()
         self.render()
 
         bounds = self.GUI_Scene.scene.bounding_box
@@ -292,6 +297,18 @@ class Interactive:
         self.loadFile()
         self.render()
 
+    def getCellSize(self):
+        return max(self.areaPositive.double_value, self.areaNegative.double_value, 1e-3)
+
+    def buildIndex(self):
+        # Built once per loaded point cloud (and click area), every click is then only a radius query
+        self.index = SpatialIndex(self.pcd_original.point.positions.numpy(), self.getCellSize())
+
+    def onAreaChange(self, value):
+        # Cells much smaller than the click area would make every query visit many cells
+        if self.index is not None and self.index.cell_size != self.getCellSize():
+            self.buildIndex()
+
     def onClick(self, event):
         def click(depth_image):
             x = event.x - self.GUI_Scene.frame.x
@@ -306,25 +323,18 @@ class Interactive:
                     x, y, depth, self.GUI_Scene.frame.width,
                     self.GUI_Scene.frame.height)
 
-            pcd_tree = o3d.geometry.PointCloud()
-            pcd_tree.points = o3d.utility.Vector3dVector(
-                self.pcd_original.point.positions.numpy())
-            tree = o3d.geometry.KDTreeFlann(pcd_tree)
-            
             positive = event.is_modifier_down(gui.KeyModifier.CTRL)
             
-            [_, idx, _] = tree.search_radius_vector_3d(coords, self.areaPositive.double_value if positive
-                                                       else self.areaNegative.double_value)
+            [idx] = self.index.query_radius(coords, self.areaPositive.double_value if positive
+                                            else self.areaNegative.double_value)
 
             if positive:
                 self.maskPositive.append(list(idx))
             else:
                 self.maskNegative.append(list(idx))
-            for i in idx:
-                if positive:
-                    self.pcd_original.point.maskPositive[i] = 1
-                else:
-                    self.pcd_original.point.maskNegative[i] = 1
+            # One scatter into the (shared CPU memory) NumPy view instead of a tensor write per point
+            mask = self.pcd_original.point.maskPositive if positive else self.pcd_original.point.maskNegative
+            mask.numpy()[idx] = 1
                     
             # Fix for broken rendering (on some systems it doesn't render correctly)
             # When the fix is enabled, you need to re-render manually by presing space 
@@ -383,6 +393,7 @@ class Interactive:
             self.downsample.int_value = 0
         elif value > 0:
             self.pcd_original = self.pcd_original.uniform_down_sample(every_k_points=int(value))
+            self.buildIndex()
         self.render()
 
 
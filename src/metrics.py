@@ -0,0 +1,105 @@
+import json
+import time
+from contextlib import contextmanager
+
+import torch
+from torch.profiler import record_function
+
+_END = object()
+
+
+class StageTimer:
+    # Wall time of named stages of a train step. With sync, CUDA is synchronized at the end of every stage,
+    # so kernels are counted in the stage that launched them instead of the next one that waits for them.
+    # Stages are also regions of torch.profiler traces.
+    def __init__(self, sync=False, enabled=True):
+        self.sync = sync
+        self.enabled = enabled
+        self.times = {}
+        self.totals = {}
+        self.steps = 0
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        with record_function(name):
+            try:
+                yield
+            finally:
+                if self.sync:
+                    torch.cuda.synchronize()
+        self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.times[name] = self.times.get(name, 0) + seconds
+
+    def end_step(self):
+        # {stage: seconds} of the finished step
+        times = self.times
+        for name, seconds in times.items():
+            self.totals[name] = self.totals.get(name, 0) + seconds
+        self.times = {}
+        self.steps += 1
+        return times
+
+    def summary(self):
+        # Mean time of stages per step since the last summary
+        steps = max(self.steps, 1)
+        summary = ', '.join(f'{name} {1000 * seconds / steps:.1f}' for name, seconds in self.totals.items())
+        self.totals = {}
+        self.steps = 0
+        return f'stage times (ms per step): {summary}'
+
+
+NO_TIMER = StageTimer(enabled=False)
+
+
+def timed_iter(iterable, timer, name):
+    # Time spent waiting for every item is added to the stage name
+    iterator = iter(iterable)
+    while True:
+        with timer.stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+class TimedCollate:
+    # Returns (batch, seconds of collate_fn), so the collate time is known also when it runs in a worker process
+    def __init__(self, collate_fn):
+        self.collate_fn = collate_fn
+
+    def __call__(self, samples):
+        start = time.perf_counter()
+        batch = self.collate_fn(samples)
+        return batch, time.perf_counter() - start
+
+
+class MetricsLog:
+    # Append-only JSON lines, one record per train step or validation (plot_metrics.py plots them)
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a')
+
+    def write(self, kind, **values):
+        self.file.write(json.dumps({'type': kind, 'time': time.time(), **values}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_metrics(path):
+    # Records of the log, a line cut off by a killed training is ignored
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+    return records
@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import open3d as o3d
+
+import scene_format
+
+
+def estimate_normals(positions, max_nn=30, radius=None, chunks=1, workers=1):
+    positions = np.ascontiguousarray(positions, dtype=np.float32)
+
+    # Chunks need a bounded neighborhood (radius)
+    if chunks > 1 and radius is None:
+        raise ValueError(f'Normal estimation in {chunks} chunks requires a radius')
+    if chunks <= 1 or len(positions) == 0:
+        return estimate_normals_chunk(positions, max_nn, radius)
+
+    # Split the cloud into slabs along its longest axis, every slab is extended by radius on both
+    # sides, so the neighborhoods of its own points are the same as in the whole cloud
+    axis = np.argmax(np.ptp(positions, axis=0))
+    x = positions[:, axis]
+    bounds = np.quantile(x, np.linspace(0, 1, chunks + 1))
+    normals = np.empty_like(positions)
+
+    def process_chunk(i):
+        lo, hi = bounds[i], bounds[i + 1]
+        core = (x >= lo) & ((x < hi) if i < chunks - 1 else (x <= hi))
+        if not core.any():
+            return
+        halo = np.flatnonzero((x >= lo - radius) & (x <= hi + radius))
+        chunk_normals = estimate_normals_chunk(positions[halo], max_nn, radius)
+        normals[core] = chunk_normals[core[halo]]
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        list(executor.map(process_chunk, range(chunks)))
+
+    return normals
+
+
+def estimate_normals_chunk(positions, max_nn, radius):
+    pcd = o3d.t.geometry.PointCloud(o3d.core.Tensor(positions))
+    pcd.estimate_normals(max_nn=max_nn, radius=radius)
+    return pcd.point.normals.numpy()
+
+
+def get_normals(path, max_nn=30, radius=None, chunks=1, workers=1):
+    # Normals are computed on the first request and cached next to the data
+    # (as a column of a .scene folder or as <name>.normals.npy next to a .pcd file)
+    if scene_format.is_scene(path):
+        scene = scene_format.read_scene(path)
+        if scene.normals is None:
+            normals = estimate_normals(scene.positions, max_nn, radius, chunks, workers)
+            scene_format.write_column(path, "normals", normals)
+            scene = scene_format.read_scene(path)
+        return scene.normals
+
+    pcd = o3d.t.io.read_point_cloud(path)
+    if "normals" in pcd.point:
+        return pcd.point.normals.numpy()
+
+    cache_path = os.path.splitext(path)[0] + ".normals.npy"
+    if not os.path.exists(cache_path):
+        normals = estimate_normals(pcd.point.positions.numpy(), max_nn, radius, chunks, workers)
+        np.save(cache_path, normals)
+    return np.load(cache_path, mmap_mode="r")
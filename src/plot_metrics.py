@@ -0,0 +1,70 @@
+import os
+import argparse
+from collections import Counter
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from metrics import read_metrics
+
+
+def parseargs():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--metrics_path", default="../stats/metrics.jsonl",
+                        help="Metrics log written by train.py (default: ../stats/metrics.jsonl)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Output image (default: losses.png next to the metrics log)")
+    parser.add_argument("-w", "--window", type=int, default=50,
+                        help="Steps of the moving average of stage times (default: 50)")
+    return parser.parse_args()
+
+
+def moving_average(values, window):
+    window = max(1, min(window, len(values)))
+    return np.convolve(values, np.ones(window) / window, mode='valid')
+
+
+def main(args):
+    records = read_metrics(args.metrics_path)
+    steps = [r for r in records if r['type'] == 'train' and r.get('skip') is None]
+    skipped = [r for r in records if r['type'] == 'train' and r.get('skip') is not None]
+    validations = [r for r in records if r['type'] == 'validation']
+    print(f'{len(steps)} train steps, {len(skipped)} skipped batches, {len(validations)} validations')
+    if skipped:
+        print(f'Skip reasons: {dict(Counter(r["skip"] for r in skipped))}')
+
+    stages = sorted({name for r in steps + skipped for name in r['stages']})
+    stage_times = {name: np.array([1000 * r['stages'].get(name, 0) for r in steps]) for name in stages}
+    for name, times in sorted(stage_times.items(), key=lambda item: -item[1].sum()):
+        print(f'{name:>12}: mean {times.mean():8.1f} ms, max {times.max():8.1f} ms')
+
+    fig, ax = plt.subplots(2, 2, figsize=(12, 8))
+    step_ids = [r['step'] for r in steps]
+    ax[0, 0].plot(step_ids, [r['loss'] for r in steps])
+    ax[0, 0].set_yscale('log')
+    ax[0, 0].set_title('Train losses')
+    ax[0, 1].plot(step_ids, [r['iou'] for r in steps], label='train (voxels)')
+    if validations:
+        ax[0, 1].plot([r['step'] for r in validations], [r['iou'] for r in validations], 'o-', label='validation')
+    ax[0, 1].set_title('IOU')
+    ax[0, 1].legend()
+    # Moving average of stage times stacked (stages don't overlap), so the top line is the timed part of the step
+    if steps:
+        smoothed = [moving_average(stage_times[name], args.window) for name in stages]
+        ax[1, 0].stackplot(step_ids[len(step_ids) - len(smoothed[0]):], smoothed, labels=stages)
+        ax[1, 0].legend(loc='upper left', fontsize='small')
+    ax[1, 0].set_title(f'Stage times (ms, mean of {args.window} steps)')
+    ax[1, 1].plot(step_ids, [r['voxels'] for r in steps])
+    ax[1, 1].set_title('Voxels per batch')
+    for axis in ax.flat:
+        axis.set_xlabel('Trained steps')
+    plt.tight_layout()
+
+    output = args.output or os.path.join(os.path.dirname(args.metrics_path), 'losses.png')
+    print(f'Saving plots to {output}')
+    plt.savefig(output)
+
+
+if __name__ == "__main__":
+    args = parseargs()
+    main(args)
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+
+_ITEM, _END, _ERROR = range(3)
+
+
+class Prefetcher:
+    # Iterates an iterable in a background thread, up to depth items ahead of the consumer.
+    # wait_time is how long the consumer was blocked waiting for the next item.
+    # depth=0 produces items inline (no thread), wait_time is then the whole production time.
+    # Use it as a context manager (or call close), so the thread stops when the consumer quits early.
+    def __init__(self, iterable, depth=2):
+        self.depth = depth
+        self.wait_time = 0
+        self.items = 0
+        self.iterator = iter(iterable)
+        self.stopped = threading.Event()
+
+        if depth > 0:
+            self.queue = queue.Queue(maxsize=depth)
+            self.thread = threading.Thread(target=self.produce, daemon=True)
+            self.thread.start()
+
+    def produce(self):
+        try:
+            for item in self.iterator:
+                if not self.put((_ITEM, item)):
+                    return
+        except BaseException as e:
+            self.put((_ERROR, e))
+            return
+        self.put((_END, None))
+
+    def put(self, entry):
+        # Gives up when the consumer has closed the prefetcher
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self):
+        if self.depth == 0:
+            try:
+                return _ITEM, next(self.iterator)
+            except StopIteration:
+                return _END, None
+        return self.queue.get()
+
+    def __iter__(self):
+        while True:
+            start = time.perf_counter()
+            kind, item = self.get()
+            self.wait_time += time.perf_counter() - start
+
+            if kind == _END:
+                return
+            if kind == _ERROR:
+                raise item
+            self.items += 1
+            yield item
+
+    def close(self):
+        # Stops the producer and drops the items it has prepared
+        self.stopped.set()
+        if self.depth > 0:
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        per_item = 1000 * self.wait_time / self.items if self.items else 0
+        return (f'prefetch (depth {self.depth}): {self.items} samples, consumer waited {self.wait_time:.2f} s '
+                f'({per_item:.1f} ms per sample)')
@@ -0,0 +1,93 @@
+import os
+import argparse
+
+import torch
+from torch.profiler import ProfilerActivity
+
+
+def parse_schedule(value):
+    # "wait,warmup,active" steps of the profiler schedule
+    try:
+        steps = tuple(int(steps) for steps in value.split(','))
+    except ValueError:
+        steps = ()
+    if len(steps) != 3 or min(steps) < 0 or steps[2] == 0:
+        raise argparse.ArgumentTypeError(f'expected three non-negative integers wait,warmup,active with active > 0, got "{value}"')
+    return steps
+
+
+def add_profile_args(parser):
+    parser.add_argument("--profile", action='store_true', default=False,
+                        help="Record torch.profiler traces of a few steps (default: False)")
+    parser.add_argument("--profile_dir", type=str, default='../profile',
+                        help="Where to store Chrome traces and tables of top operators (default: ../profile)")
+    parser.add_argument("--profile_schedule", type=parse_schedule, default='5,2,5',
+                        help="Steps to wait, warm up and record, comma separated (default: 5,2,5)")
+
+
+class NoProfiler:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def step(self):
+        pass
+
+
+class ScheduledProfiler:
+    # torch.profiler for one wait/warmup/active cycle, use it as a context manager and call step() after every step.
+    # Regions are labelled with record_function (e.g. the stages of metrics.StageTimer).
+    def __init__(self, output_dir, name, schedule, row_limit=30):
+        self.name = name
+        self.wait, self.warmup, self.active = schedule
+        self.steps = 0
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=self.wait, warmup=self.warmup, active=self.active, repeat=1),
+            on_trace_ready=export_trace(output_dir, name, row_limit))
+
+    def __enter__(self):
+        self.profiler.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Stopping in the active steps exports what was recorded so far
+        self.profiler.__exit__(*exc_info)
+        if self.steps < self.wait + self.warmup:
+            print(f'Warning: {self.name} ended after {self.steps} steps, before profiling started '
+                  f'(after {self.wait + self.warmup} steps), no trace was saved')
+        elif self.steps < self.wait + self.warmup + self.active:
+            print(f'Warning: {self.name} ended after {self.steps} steps, '
+                  f'the trace has {self.steps - self.wait - self.warmup} of {self.active} active steps')
+
+    def step(self):
+        self.steps += 1
+        self.profiler.step()
+
+
+def get_profiler(enabled, output_dir, name, schedule=(5, 2, 5)):
+    if not enabled:
+        return NoProfiler()
+    os.makedirs(output_dir, exist_ok=True)
+    wait, warmup, active = schedule
+    print(f'Profiling {active} steps after {wait + warmup} steps, traces are saved to {output_dir}')
+    return ScheduledProfiler(output_dir, name, schedule)
+
+
+def export_trace(output_dir, name, row_limit):
+    def on_trace_ready(profiler):
+        trace_path = os.path.join(output_dir, f'{name}_trace_{profiler.step_num}.json')
+        profiler.export_chrome_trace(trace_path)
+        sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+        table = profiler.key_averages().table(sort_by=sort_by, row_limit=row_limit)
+        table_path = os.path.join(output_dir, f'{name}_ops_{profiler.step_num}.txt')
+        with open(table_path, 'w') as f:
+            f.write(table)
+        print(f'\n{table}')
+        print(f'Profile saved to {trace_path} and {table_path}')
+    return on_trace_ready
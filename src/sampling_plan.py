@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import tempfile
+import zipfile
+
+import numpy as np
+
+# Version of the cached plan layout, bump it when the arrays or the way clicks are simulated change
+PLAN_VERSION = 3
+
+
+class SamplingPlan:
+    # Simulated clicks of a dataset as flat arrays. Every object has a range of samples
+    # (object_offsets) and every sample, a group of 1-3 clicks, has a range of click_points
+    # (sample_offsets). object_range is the contiguous [start, end) point range of the object
+    # in its scene or (-1, -1) when its points are not contiguous. object_bbox is the min and max
+    # corner of the object's points.
+    ARRAYS = ('object_scene', 'object_group', 'object_range', 'object_bbox', 'object_offsets',
+              'sample_object', 'sample_offsets', 'click_points')
+
+    def __init__(self, files, object_scene, object_group, object_range, object_bbox, object_offsets,
+                 sample_object, sample_offsets, click_points):
+        self.files = list(files)
+        self.object_scene = object_scene
+        self.object_group = object_group
+        self.object_range = object_range
+        self.object_bbox = object_bbox
+        self.object_offsets = object_offsets
+        self.sample_object = sample_object
+        self.sample_offsets = sample_offsets
+        self.click_points = click_points
+
+    @classmethod
+    def from_objects(cls, files, objects):
+        # objects is a list of dicts with scene (id), group, range ((start, end) or None), bbox (min and max corner)
+        # and samples (list of samples, lists of clicked point indices)
+        samples = [sample for obj in objects for sample in obj['samples']]
+        n_samples = np.array([len(obj['samples']) for obj in objects], dtype=np.int64)
+        n_clicks = np.array([len(sample) for sample in samples], dtype=np.int64)
+
+        return cls(files,
+                   object_scene=np.array([obj['scene'] for obj in objects], dtype=np.int32),
+                   object_group=np.array([obj['group'] for obj in objects], dtype=np.int64),
+                   object_range=np.array([obj['range'] if obj['range'] is not None else (-1, -1) for obj in objects],
+                                         dtype=np.int64).reshape((-1, 2)),
+                   object_bbox=np.array([obj['bbox'] for obj in objects], dtype=np.float32).reshape((-1, 2, 3)),
+                   object_offsets=np.concatenate(([0], np.cumsum(n_samples))),
+                   sample_object=np.repeat(np.arange(len(objects), dtype=np.int32), n_samples),
+                   sample_offsets=np.concatenate(([0], np.cumsum(n_clicks))),
+                   click_points=np.array([point for sample in samples for point in sample], dtype=np.int64))
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @property
+    def n_objects(self):
+        return len(self.object_scene)
+
+    @property
+    def n_samples(self):
+        return len(self.sample_object)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def digest(self):
+        # Identifies the simulated clicks, data derived from them is cached under it
+        sha1 = hashlib.sha1()
+        for array in self.arrays().values():
+            sha1.update(np.ascontiguousarray(array).tobytes())
+        return sha1.hexdigest()[:16]
+
+    def get_click_scenes(self):
+        # Scene id of every click
+        samples = np.repeat(np.arange(self.n_samples), np.diff(self.sample_offsets))
+        return self.object_scene[self.sample_object[samples]]
+
+    def get_range(self, obj):
+        start, end = self.object_range[obj]
+        return None if start < 0 else (int(start), int(end))
+
+    def get_sample_clicks(self, sample):
+        # Range of the sample's clicks in click_points
+        return int(self.sample_offsets[sample]), int(self.sample_offsets[sample + 1])
+
+    def get_object_clicks(self, obj, n_of_samples):
+        # Range of the clicks of the first n samples of an object in click_points
+        first = self.object_offsets[obj]
+        last = min(first + n_of_samples, self.object_offsets[obj + 1])
+        return int(self.sample_offsets[first]), int(self.sample_offsets[last])
+
+    def stats(self):
+        return (f'sampling plan: {len(self.files)} scenes, {self.n_objects} objects, {self.n_samples} samples, '
+                f'{len(self.click_points)} clicks, {self.nbytes / 1024**2:.2f} MB')
+
+
+def get_source_signature(files):
+    # Size and modification time of every source file (every column file for scene directories)
+    signature = []
+    for file in sorted(files):
+        paths = [os.path.join(file, name) for name in sorted(os.listdir(file))] if os.path.isdir(file) else [file]
+        for path in paths:
+            stat = os.stat(path)
+            signature.append([os.path.relpath(path, os.path.dirname(file)), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def get_plan_key(params, files):
+    # Plans built from the same sources with the same parameters share the key (and the cache file)
+    key = {'version': PLAN_VERSION, 'params': params, 'sources': get_source_signature(files)}
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def save_plan(path, plan, key, params):
+    directory = os.path.dirname(path) or '.'
+    files = [os.path.relpath(file, directory) for file in plan.files]
+    save_arrays(path, plan.arrays(), {'key': key, 'params': params, 'files': files})
+
+
+def load_plan(path, key):
+    loaded = load_arrays(path, key, SamplingPlan.ARRAYS)
+    if loaded is None:
+        return None
+    meta, arrays = loaded
+    directory = os.path.dirname(path) or '.'
+    return SamplingPlan([os.path.join(directory, file) for file in meta['files']], **arrays)
+
+
+def save_arrays(path, arrays, meta):
+    # Written to a temporary file and renamed, so readers never see a partially written cache
+    # and concurrent writers of the same plan just replace each other's complete file
+    meta = dict(meta, version=PLAN_VERSION)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_arrays(path, key, names):
+    # Returns (meta, arrays) or None when the cache is from another version, for other sources or unreadable
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['version'] != PLAN_VERSION or meta['key'] != key:
+                return None
+            return meta, {name: data[name] for name in names}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f'Could not read DataLoader cache {path}: {e}')
+        return None
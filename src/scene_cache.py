@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+
+class SceneCache:
+    # LRU cache of decoded scenes limited by the total size of cached entries in bytes.
+    # Entries are shared between samples and must not be modified by the caller.
+    def __init__(self, max_bytes, size_of):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        value = load()
+        size = self.size_of(value)
+        if size > self.max_bytes:
+            # Bigger than the whole budget, don't evict everything else because of it
+            return value
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = value
+                self.sizes[key] = size
+                self.nbytes += size
+                self.evict()
+            return self.entries[key]
+
+    def __getstate__(self):
+        # Copies sent to worker processes start empty (and get their own lock)
+        state = self.__dict__.copy()
+        state.update(entries=OrderedDict(), sizes={}, nbytes=0, hits=0, misses=0, lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def evict(self):
+        while self.nbytes > self.max_bytes and self.entries:
+            key, _ = self.entries.popitem(last=False)
+            self.nbytes -= self.sizes.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def stats(self):
+        requests = self.hits + self.misses
+        hit_rate = 100 * self.hits / requests if requests else 0
+        return (f'scene cache: {len(self.entries)} scenes, {self.nbytes / 1024**2:.0f}/{self.max_bytes / 1024**2:.0f} MB, '
+                f'{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)')
@@ -0,0 +1,172 @@
+import os
+import json
+import argparse
+
+import numpy as np
+import open3d as o3d
+
+# Columnar scene format
+# Every scene is a directory <name>.scene containing scene.json (number of points and columns)
+# and one raw fixed-layout file per column, which are opened with np.memmap (no parsing, no copy).
+SCENE_SUFFIX = ".scene"
+SCENE_VERSION = 1
+COLUMNS = {
+    "positions": (np.float32, 3),
+    "colors": (np.uint8, 3),
+    "group": (np.int32, 1),
+    "normals": (np.float32, 3),
+}
+
+
+class Scene:
+    def __init__(self, positions, colors, group, normals=None, colors_scale=1.0):
+        self.positions = positions
+        # Colors are stored as uint8, colors_scale is the range of the original float colors (1 or 255)
+        self.colors = colors
+        self.group = group
+        self.normals = normals
+        self.colors_scale = colors_scale
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in [self.positions, self.colors, self.group, self.normals]
+                   if column is not None)
+
+    def float_colors(self):
+        # Same float32 values as the colors in the original .pcd file
+        if self.colors_scale == 255:
+            return self.colors.astype(np.float32)
+        return (self.colors / 255).astype(np.float32)
+
+    def downsample(self, every_k_points):
+        # Same points as o3d uniform_down_sample, columns stay views of the original data
+        if every_k_points <= 1:
+            return self
+        return Scene(self.positions[::every_k_points], self.colors[::every_k_points],
+                     self.group[::every_k_points],
+                     self.normals[::every_k_points] if self.normals is not None else None,
+                     self.colors_scale)
+
+
+def is_scene(path):
+    return path.rstrip("/").endswith(SCENE_SUFFIX) and os.path.isdir(path)
+
+
+def column_path(path, column):
+    return os.path.join(path, f"{column}.bin")
+
+
+def write_scene(path, positions, colors, group, normals=None):
+    os.makedirs(path, exist_ok=True)
+    colors = np.asarray(colors)
+
+    # Float colors are converted to uint8, the original range is kept to restore them
+    colors_scale = 255.0 if colors.size and colors.max() > 1.0 else 1.0
+    colors = np.clip(np.rint(colors * (255.0 / colors_scale)), 0, 255)
+
+    columns = {"positions": positions, "colors": colors, "group": np.asarray(group).reshape(-1)}
+    if normals is not None:
+        columns["normals"] = normals
+
+    for column, data in columns.items():
+        write_column_data(path, column, data)
+
+    write_meta(path, {"version": SCENE_VERSION,
+                      "points": len(positions),
+                      "colors_scale": colors_scale,
+                      "columns": list(columns.keys())})
+
+
+def write_column(path, column, data):
+    # Add (or replace) one column of an existing scene, e.g. normals computed later
+    meta = read_meta(path)
+    assert len(data) == meta["points"], f"Column {column} has {len(data)} rows, scene has {meta['points']} points"
+    write_column_data(path, column, data)
+    if column not in meta["columns"]:
+        meta["columns"].append(column)
+        write_meta(path, meta)
+
+
+def write_column_data(path, column, data):
+    dtype, _ = COLUMNS[column]
+    np.ascontiguousarray(data, dtype=dtype).tofile(column_path(path, column))
+
+
+def read_meta(path):
+    with open(os.path.join(path, "scene.json"), "r") as f:
+        return json.load(f)
+
+
+def write_meta(path, meta):
+    with open(os.path.join(path, "scene.json"), "w") as f:
+        json.dump(meta, f)
+
+
+def read_column(path, column, n_points):
+    dtype, width = COLUMNS[column]
+    shape = (n_points, width) if width > 1 else (n_points,)
+    if n_points == 0:
+        # np.memmap can't map empty files
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(column_path(path, column), dtype=dtype, mode="r", shape=shape)
+
+
+def read_scene(path):
+    meta = read_meta(path)
+    assert meta["version"] == SCENE_VERSION, f"Unsupported scene version {meta['version']} ({path})"
+
+    n_points = meta["points"]
+    columns = {column: read_column(path, column, n_points) for column in meta["columns"]}
+    return Scene(columns["positions"], columns["colors"], columns["group"],
+                 columns.get("normals"), meta["colors_scale"])
+
+
+def scene_to_point_cloud(scene):
+    size = len(scene)
+    pcd = o3d.t.geometry.PointCloud(o3d.core.Tensor(np.asarray(scene.positions)))
+    pcd.point.colors = o3d.core.Tensor(scene.float_colors())
+    pcd.point.group = o3d.core.Tensor(np.asarray(scene.group).reshape((size, 1)))
+    pcd.point.maskPositive = o3d.core.Tensor(np.zeros((size, 1), dtype=np.uint8))
+    pcd.point.maskNegative = o3d.core.Tensor(np.zeros((size, 1), dtype=np.uint8))
+    if scene.normals is not None:
+        pcd.point.normals = o3d.core.Tensor(np.asarray(scene.normals))
+    return pcd
+
+
+def convert_point_cloud(src, dst):
+    pcd = o3d.t.io.read_point_cloud(src)
+    normals = pcd.point.normals.numpy() if "normals" in pcd.point else None
+    write_scene(dst, pcd.point.positions.numpy(), pcd.point.colors.numpy(),
+                pcd.point.group.numpy(), normals)
+
+
+def convert_dataset(src, dst):
+    # Convert every .pcd file in src (including split subfolders) to the same place in dst
+    files = [os.path.join(root, f) for root, _, names in os.walk(src) for f in names if f.endswith(".pcd")]
+    for i, file in enumerate(sorted(files)):
+        dst_path = os.path.join(dst, os.path.relpath(os.path.splitext(file)[0], src) + SCENE_SUFFIX)
+        print(f"{i+1}/{len(files)} - {os.path.relpath(file, src)}")
+
+        if os.path.exists(os.path.join(dst_path, "scene.json")):
+            print(f"\tScene already exists, skipping")
+            continue
+
+        convert_point_cloud(file, dst_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--src_path", default="../dataset/S3DIS_converted",
+                        help="Source path with .pcd files (default: ../dataset/S3DIS_converted)")
+    parser.add_argument("-d", "--dst_path", default="../dataset/S3DIS_converted_scene",
+                        help="Destination path (default: ../dataset/S3DIS_converted_scene)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.src_path):
+        print("Source path does not exist")
+        exit(1)
+
+    convert_dataset(args.src_path, args.dst_path)
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class SpatialIndex:
+    # Voxel hash of a point cloud for radius queries. Points are sorted by their cell, so every
+    # occupied cell is a range of self.order. Built once per scene and reused by every click.
+    def __init__(self, positions, cell_size):
+        self.positions = np.asarray(positions)
+        self.cell_size = cell_size
+
+        cells = self.get_cells(self.positions)
+        if len(cells) == 0:
+            cells = np.zeros((1, 3), dtype=np.int64)
+        self.min_cell = cells.min(axis=0)
+        self.dims = cells.max(axis=0) - self.min_cell + 1
+
+        keys = self.pack(cells[:len(self.positions)])
+        self.order = np.argsort(keys, kind='stable')
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+
+    @property
+    def nbytes(self):
+        return self.order.nbytes + self.keys.nbytes + self.starts.nbytes + self.counts.nbytes
+
+    def get_cells(self, positions):
+        return np.floor(np.asarray(positions, dtype=np.float64) / self.cell_size).astype(np.int64)
+
+    def pack(self, cells):
+        cells = cells - self.min_cell
+        return (cells[..., 0] * self.dims[1] + cells[..., 1]) * self.dims[2] + cells[..., 2]
+
+    def query_radius(self, centers, radius):
+        # Indices of points within radius of every center, one sorted array per center
+        centers = np.asarray(centers, dtype=np.float64).reshape((-1, 3))
+        candidates, owners = self.query_candidates(centers, radius)
+
+        distances = np.sum((self.positions[candidates].astype(np.float64) - centers[owners]) ** 2, axis=1)
+        hits = distances <= radius ** 2
+        candidates, owners = candidates[hits], owners[hits]
+
+        # Candidates are grouped by center (owners are ascending)
+        bounds = np.searchsorted(owners, np.arange(len(centers) + 1))
+        return [np.sort(candidates[bounds[i]:bounds[i + 1]]) for i in range(len(centers))]
+
+    def query_radius_union(self, centers, radius):
+        # Indices of points within radius of any of the centers (e.g. all clicks of one sample)
+        neighbors = self.query_radius(centers, radius)
+        if not neighbors:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(neighbors))
+
+    def query_candidates(self, centers, radius):
+        # All points from cells touching the cube around every center
+        if len(self.keys) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+
+        reach = int(np.ceil(radius / self.cell_size))
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps, indexing='ij'), axis=-1).reshape((-1, 3))
+
+        cells = self.get_cells(centers)[:, None, :] + offsets[None, :, :]
+        inside = np.all((cells >= self.min_cell) & (cells < self.min_cell + self.dims), axis=2)
+        owners = np.nonzero(inside)[0]
+        keys = self.pack(cells[inside])
+
+        found = np.searchsorted(self.keys, keys)
+        found_clipped = np.minimum(found, len(self.keys) - 1)
+        occupied = (found < len(self.keys)) & (self.keys[found_clipped] == keys)
+        cell_ids, owners = found[occupied], owners[occupied]
+
+        # Expand the point ranges of the found cells
+        counts = self.counts[cell_ids]
+        range_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates = self.order[np.repeat(self.starts[cell_ids], counts) + range_offsets]
+        return candidates, np.repeat(owners, counts)
@@ -29,22 +29,27 @@ import os
 import sys
 import argparse
 import time
-import re
 
 import numpy as np
 import torch
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
 import MinkowskiEngine as ME
-import matplotlib.pyplot as plt
 import open3d as o3d
 
 from InterObject3D.interactive_adaptation import InteractiveSegmentationModel
 from InterObject3D import minkunet
-from data_loader import DataLoader as CustomDataLoader
-import compute_iou
+from data_loader import DataLoader as CustomDataLoader, EpochSampler, VoxelBudgetBatchSampler, worker_init_fn
+from train_step import point_batch_inputs, voxel_batch_inputs, optimize, point_predictions
+from validation import ValidationWorker
+from metrics import MetricsLog, StageTimer, TimedCollate, timed_iter
+from profiling import add_profile_args, get_profiler
+import checkpoint
 import utils
 
+# Batches with more voxels are skipped (without --voxel_budget)
+MAX_VOXELS = 610000
+
 
 def parse_args():
     print(sys.argv)
@@ -58,6 +63,18 @@ def parse_args():
                         help="The size data points are converting to (default: 0.05)")
     parser.add_argument("-c", "--click_area", default=0.3, type=float,
                         help="Area of the simulated click points. MUST BE LARGER THAN VOXEL SIZE (default: 0.3)")
+    parser.add_argument("-f", "--data_format", default='pcd', choices=['pcd', 'scene'],
+                        help="Dataset format, .pcd files or memory-mapped columnar scenes (default: pcd)")
+    parser.add_argument("--scene_cache_mb", type=int, default=2048,
+                        help="Memory budget of the in-process cache of decoded scenes in MB (default: 2048)")
+    parser.add_argument("--crop_margin", type=float, default=0,
+                        help="Crop samples to the object's bounding box grown by this margin in meters (default: 0 = whole room)")
+    parser.add_argument("-q", "--quantize_in_loader", action='store_true', default=False,
+                        help="Voxelize samples in the data loader (workers), the trainer gets voxels instead of points (default: False)")
+    parser.add_argument("--prevalidate", action='store_true', default=False,
+                        help="Leave out samples whose clicks don't survive quantization or with too few foreground voxels, checked once when the plan is loaded (default: False)")
+    parser.add_argument("--precompute_clicks", action='store_true', default=False,
+                        help="Precompute and cache the points inside every click area, samples then skip the radius search (default: False)")
 
     parser.add_argument("-m", "--pretrained_model_path", type=str, default=None,
                         help="Pretrained model path to start training with (default: None)")
@@ -69,10 +86,23 @@ def parse_args():
                         help='Where to store validation results.')
     parser.add_argument('-s', '--save_step', type=int, default=50,
                         help='How often to save checkpoint')
+    parser.add_argument('--keep_last', type=int, default=0,
+                        help='Keep only this many newest checkpoints (default: 0 = keep all, only the newest one with --keep_best)')
+    parser.add_argument('--keep_best', type=int, default=0,
+                        help='Also keep this many checkpoints with the best validation IoU (default: 0)')
     parser.add_argument('-t', '--test_step', type=int, default=10,
                         help='How often to test model with validation set')
+    parser.add_argument('--validation_device', type=str, default=None,
+                        help='Device of the validation process (default: the training device)')
+    parser.add_argument('--max_pending_validations', type=int, default=2,
+                        help='Test steps are skipped while this many validations are still running (default: 2)')
     parser.add_argument('-g', '--stats_path', type=str, default='../stats',
                         help='Where to store training stats')
+    parser.add_argument('--metrics_path', type=str, default=None,
+                        help='JSON lines log of every step with timings of its stages, plotted by plot_metrics.py (default: <stats_path>/metrics.jsonl)')
+    parser.add_argument('--sync_timings', action='store_true', default=False,
+                        help='Synchronize CUDA after every stage, so GPU time is counted in the stage that launched it. '
+                             'Stalls the CPU every step, only for finding bottlenecks (default: False)')
     parser.add_argument('-sl', '--saved_loss', type=str, default=None,
                         help='Path to saved training loss data from previous training')
     parser.add_argument('-siv', '--saved_ious_val', type=str, default=None,
@@ -80,10 +110,22 @@ def parse_args():
     parser.add_argument('-sit', '--saved_ious_train', type=str, default=None,
                         help='Path to saved IOU data from previous training')
     parser.add_argument('-b', '--batch_size', default=20, type=int)
+    parser.add_argument('--point_iou', action='store_true', default=False,
+                        help='Compute train IoU on points (slice of the output) instead of voxels, with --quantize_in_loader '
+                             'samples then also carry their point labels (default: False)')
+    parser.add_argument('--voxel_budget', default=0, type=int,
+                        help='Fill every batch with samples up to this number of voxels instead of using a fixed batch_size, at most 610000 (default: 0 = fixed batch_size)')
+    parser.add_argument('-w', '--workers', default=0, type=int,
+                        help='Number of data loading worker processes, every worker has its own scene cache (default: 0)')
+    parser.add_argument('--seed', default=None, type=int,
+                        help='Seed of the order of training samples (default: random)')
+    add_profile_args(parser)
     parser.add_argument('--max_epochs', default=10, type=int)
     parser.add_argument('--lr', default=0.001, type=float)
 
     args = parser.parse_args()
+    if args.voxel_budget > MAX_VOXELS:
+        parser.error(f'--voxel_budget can be at most {MAX_VOXELS} voxels (the biggest batch trained without a budget)')
     print(f'args: {args}')
     return args
 
@@ -95,129 +137,191 @@ def main(args):
     utils.ensure_folder_exists(args.stats_path)
 
     inseg_model_class, inseg_global_model, train_step = get_model(args.pretrained_model_path, args.output_dir, args.model_class, device)
-
-    optimizer = optim.SGD(
-        inseg_global_model.parameters(),
-        lr=args.lr)
-    criterion = torch.nn.CrossEntropyLoss(ignore_index=-100)
-
-    train_dataset = CustomDataLoader(args.dataset_path, verbose=False, click_area=args.click_area, normalize_colors=True, voxel_size=args.voxel_size)
-
-    # create cache for validation dataset
-    val_dataloader = CustomDataLoader(args.val_dataset, verbose=False, click_area=args.click_area, limit_to_one_object=True, normalize_colors=True)
-
-    train_dataloader = DataLoader(
-        train_dataset,
-        batch_size=args.batch_size,
-        collate_fn=ME.utils.batch_sparse_collate)
-
-    train_losses, val_ious, train_ious = load_stats(args.saved_loss, args.saved_ious_val, args.saved_ious_train)
-    train_ious_before_slice = []
-    voxel_size = args.voxel_size
-    test_step_time = time.time()
-    start_time = time.time()
-
-    train_steps_in_epoch = train_dataset.remaining_unique_elements() // args.batch_size
-    print(f'Train steps in one epoch: {train_steps_in_epoch}')
-    print(f'Training started at {time.ctime()}\n')
-
-    for epoch in range(args.max_epochs):
-        train_dataset.new_epoch()
-        epoch_time = time.time()
-        train_iter = iter(train_dataloader)
-        inseg_global_model.train()
-
-        for _ in range(train_steps_in_epoch):
-            train_batch = next(train_iter)
-
-            if train_step % 5 == 0:
-                torch.cuda.empty_cache()  # release unassigned variables/tensors from GPU memory
-
-            if args.test_step > 0 and train_step % args.test_step == 0:
-                inseg_global_model.eval()
-                print('\n\n-------------------------------------------------------------------------------------')
-                print(f'Epoch: {epoch} train_step: {train_step}, mean loss: {sum(train_losses[-args.test_step:]) / args.test_step:.2f}, '
-                      f'time of test_step: {utils.timeit(test_step_time)}, '
-                      f'time from start: {utils.timeit(start_time)}')
-                # val_iou = test_step(inseg_model_class, inseg_global_model, val_dataloader)
-                iou_args = {'src_path': args.val_dataset, 
-                            'model_path': " ", 
-                            'output_dir': f'{args.validation_out}_{train_step}', 
-                            'inseg_model': inseg_model_class, 
-                            'inseg_global': inseg_global_model,
-                            'show_3d': False,
-                            'limit_to_one_object': True,
-                            'verbose': False,
-                            'max_imgs': 5,
-                            'click_area': args.click_area,
-                            'voxel_size': voxel_size}
-                val_iou = compute_iou.main(iou_args)
-                val_ious.append(val_iou)
-                print(f'Validation finished with mean IOU: {val_iou}')
-                plot_stats(train_losses, val_ious, train_ious, train_step, args.stats_path)
-                test_step_time = time.time()
-                print('-------------------------------------------------------------------------------------\n')
+    # Checkpoints are written in the background, the training loop only waits for the copy of weights to CPU
+    checkpoint_writer = checkpoint.CheckpointWriter(args.output_dir, keep_last=args.keep_last, keep_best=args.keep_best)
+    validation_worker = None
+    metrics_log = None
+
+    try:
+        optimizer = optim.SGD(
+            inseg_global_model.parameters(),
+            lr=args.lr)
+        criterion = torch.nn.CrossEntropyLoss(ignore_index=-100)
+
+        train_dataset = CustomDataLoader(args.dataset_path, verbose=False, click_area=args.click_area, normalize_colors=True, voxel_size=args.voxel_size,
+                                         data_format=args.data_format, scene_cache_mb=args.scene_cache_mb,
+                                         precompute_clicks=args.precompute_clicks, crop_margin=args.crop_margin,
+                                         quantize=args.quantize_in_loader, with_points=args.point_iou)
+
+        # create cache for validation dataset
+        val_dataloader = CustomDataLoader(args.val_dataset, verbose=False, click_area=args.click_area, limit_to_one_object=True, normalize_colors=True,
+                                          data_format=args.data_format, crop_margin=args.crop_margin)
+
+        # Samples are drawn by index, so workers never share state and each sample is used once per epoch
+        seed = args.seed if args.seed is not None else int(time.time())
+        print(f'Sampler seed: {seed}')
+        valid_samples = train_dataset.get_valid_samples() if args.prevalidate else np.ones(len(train_dataset), dtype=bool)
+        if args.voxel_budget > 0:
+            # Voxel counts of samples are precomputed, so no batch is over the budget (and thrown away)
+            train_sampler = VoxelBudgetBatchSampler(train_dataset.get_sample_voxels(), args.voxel_budget, seed, valid_samples)
+            print(f'Voxel budget {args.voxel_budget}: {train_sampler.skipped} samples bigger than the budget are not used')
+            batching = {'batch_sampler': train_sampler}
+        else:
+            train_sampler = EpochSampler(np.nonzero(valid_samples)[0], seed)
+            batching = {'batch_size': args.batch_size, 'sampler': train_sampler, 'drop_last': True}
+        train_dataloader = DataLoader(
+            train_dataset,
+            num_workers=args.workers,
+            worker_init_fn=worker_init_fn,
+            persistent_workers=args.workers > 0,
+            collate_fn=TimedCollate(collate_quantized if args.quantize_in_loader else ME.utils.batch_sparse_collate),
+            **batching)
+
+        # Validation runs in its own process on a snapshot of the weights, results are collected when they are done
+        if args.test_step > 0:
+            validation_worker = ValidationWorker(args.model_class, args.validation_device or device, args.max_pending_validations)
+        model_name = inseg_global_model.__class__.__name__
+
+        train_losses, val_ious, train_ious = load_stats(args.saved_loss, args.saved_ious_val, args.saved_ious_train)
+        voxel_size = args.voxel_size
+        metrics_log = MetricsLog(args.metrics_path or os.path.join(args.stats_path, 'metrics.jsonl'))
+        print(f'Metrics are logged to {metrics_log.path}')
+        # Stages of every step, data is the wait for the next batch and collate the time of collate_fn.
+        # Without --sync_timings GPU time is counted in the stage that waits for it (e.g. loss.item() in iou)
+        timer = StageTimer(sync=args.sync_timings and device == 'cuda')
+        test_step_time = time.time()
+        start_time = time.time()
+
+        print(f'Train steps in one epoch: {len(train_dataloader)}')
+        print(f'Training started at {time.ctime()}\n')
+
+        with get_profiler(args.profile, args.profile_dir, 'train', args.profile_schedule) as profiler:
+            for epoch in range(args.max_epochs):
+                train_sampler.set_epoch(epoch)
+                epoch_time = time.time()
                 inseg_global_model.train()
-
-            if train_step % args.save_step == 0:
-                save_step(inseg_global_model, args.output_dir, train_step)
-
-            train_step+=1
-
-            # point cloud inputs
-            coords, feats, labels = train_batch
-            labels = labels_to_logit_shape(labels)
-            labels = labels.float()
-            feats = feats.float()
-
-            # voxelized input
-            super_feats = torch.cat((feats, labels), dim=1)
-            super_sinput = ME.SparseTensor(super_feats.float(), coords, device=device)
-            sinput = ME.SparseTensor(super_sinput.F[:, :-2], super_sinput.C, device=device)
-            slabels = ME.SparseTensor(super_sinput.F[:, -2:], super_sinput.C, device=device)
-            print(F'{sinput.F.shape=}, {slabels.F.shape=}')
-            if not clicks_in_sinput(sinput, args.batch_size) or not labels_in_sinput(slabels) or tensor_too_big(sinput, 610000):
-                continue
-
-            # voxelized output
-            sout = inseg_global_model(sinput)
-            optimizer.zero_grad()
-            # sout_for_loss = torch.softmax(sout.F, dim=1)
-            # loss = criterion(sout_for_loss, slabels.F)
-            loss = criterion(sout.F, slabels.F)
-            loss.backward()
-            optimizer.step()
-            train_losses.append(loss.item())
-            train_iou_before_slice = inseg_model_class.mean_iou(sout.F.argmax(dim=1), slabels.F.argmax(dim=1)).cpu()
-
-            # save first 10 voxelized point clouds (first out of every batch) for every test_step
-            if args.test_step > 0 and train_step % args.test_step < 5:
-                train_step_to_save = train_step - (train_step %  args.test_step)
-                visualize_one_voxelized_point_cloud(sinput, slabels, sout, train_iou_before_slice,
-                                                    os.path.join(args.output_dir, f'train_results_{train_step_to_save}'),
-                                                    train_step %  args.test_step)
-
-            # point cloud output
-            out = sout.slice(super_sinput)
-            out = out.F.argmax(dim=1).cpu()
-            labels = labels.argmax(dim=1)
-            train_iou = inseg_model_class.mean_iou(out, labels).cpu()
-            train_ious.append(train_iou)
-            print(f'train_loss: {loss.item():.5f}, train_iou_before_slice: {train_iou_before_slice:.5f}, train_iou: {train_iou:.5f}')
-            print('.', end='', flush=True)
-
-        print(f'\n\nEpoch {epoch} took {utils.timeit(epoch_time)}')
+                skipped_batches = 0
+
+                for train_batch, collate_time in timed_iter(train_dataloader, timer, 'data'):
+                    timer.add('collate', collate_time)
+                    if args.workers == 0:
+                        # collate_fn ran inside the wait for the batch, it is counted only once
+                        timer.add('data', -collate_time)
+                    step = train_step
+                    if train_step % 5 == 0:
+                        torch.cuda.empty_cache()  # release unassigned variables/tensors from GPU memory
+
+                    if validation_worker is not None:
+                        collect_validation(validation_worker.poll(), val_ious, metrics_log, checkpoint_writer, model_name, args.keep_best)
+
+                    if args.test_step > 0 and train_step % args.test_step == 0:
+                        print('\n\n-------------------------------------------------------------------------------------')
+                        print(f'Epoch: {epoch} train_step: {train_step}, mean loss: {sum(train_losses[-args.test_step:]) / args.test_step:.2f}, '
+                              f'time of test_step: {utils.timeit(test_step_time)}, '
+                              f'time from start: {utils.timeit(start_time)}')
+                        print(timer.summary())
+                        # val_iou = test_step(inseg_model_class, inseg_global_model, val_dataloader)
+                        iou_args = {'src_path': args.val_dataset, 
+                                    'model_path': " ", 
+                                    'output_dir': f'{args.validation_out}_{train_step}', 
+                                    'show_3d': False,
+                                    'limit_to_one_object': True,
+                                    'verbose': False,
+                                    'max_imgs': 5,
+                                    'click_area': args.click_area,
+                                    'voxel_size': voxel_size,
+                                    'data_format': args.data_format,
+                                    'scene_cache_mb': args.scene_cache_mb,
+                                    'crop_margin': args.crop_margin,
+                                    'device': args.validation_device or device}  # the device of the worker's model
+                        with timer.stage('validation'):
+                            if validation_worker.submit(inseg_global_model, train_step, iou_args):
+                                print(f'Validation of train_step {train_step} started')
+                        test_step_time = time.time()
+                        print('-------------------------------------------------------------------------------------\n')
+
+                    if train_step % args.save_step == 0:
+                        with timer.stage('checkpoint'):
+                            checkpoint_writer.save(inseg_global_model, train_step)
+
+                    train_step+=1
+
+                    # voxelized input (one SparseTensor, labels are a tensor aligned with its rows)
+                    with timer.stage('build'):
+                        if args.quantize_in_loader:
+                            sinput, slabels, point_labels, point_voxels = voxel_batch_inputs(train_batch, device)
+                        else:
+                            sinput, slabels, point_labels, point_voxels = point_batch_inputs(train_batch, device)
+                    # points are unknown when the loader returns only voxels
+                    voxels, points = sinput.F.shape[0], len(point_labels) if point_labels is not None else None
+                    # With a voxel budget no batch is bigger than MAX_VOXELS (checked in parse_args)
+                    skip = skip_reason(sinput, slabels, args.batch_size, MAX_VOXELS if args.voxel_budget <= 0 else None)
+                    if skip is not None:
+                        skipped_batches += 1
+                        metrics_log.write('train', epoch=epoch, step=step, skip=skip, voxels=voxels, points=points, stages=timer.end_step())
+                        profiler.step()
+                        continue
+
+                    # voxelized output
+                    sout, loss = optimize(inseg_global_model, optimizer, criterion, sinput, slabels, timer)
+                    with timer.stage('iou'):
+                        loss = loss.item()
+                        train_losses.append(loss)
+                        train_iou_before_slice = inseg_model_class.mean_iou(sout.F.argmax(dim=1), slabels.argmax(dim=1)).item()
+
+                    # save first 10 voxelized point clouds (first out of every batch) for every test_step
+                    if args.test_step > 0 and train_step % args.test_step < 5:
+                        train_step_to_save = train_step - (train_step %  args.test_step)
+                        with timer.stage('visualize'):
+                            visualize_one_voxelized_point_cloud(sinput, slabels, sout, train_iou_before_slice,
+                                                                os.path.join(args.output_dir, f'train_results_{train_step_to_save}'),
+                                                                train_step %  args.test_step)
+
+                    # point cloud output, only when asked for (voxel IoU is recorded otherwise)
+                    point_iou = None
+                    if args.point_iou:
+                        with timer.stage('slice'):
+                            out = point_predictions(sout, point_voxels)
+                            point_iou = inseg_model_class.mean_iou(out, point_labels.to(out.device)).item()
+                    train_ious.append(point_iou if args.point_iou else train_iou_before_slice)
+                    metrics_log.write('train', epoch=epoch, step=step, loss=loss, iou=train_iou_before_slice, point_iou=point_iou,
+                                      voxels=voxels, points=points, stages=timer.end_step())
+                    profiler.step()
+                    print('.', end='', flush=True)
+
+                print(f'\n\nEpoch {epoch} took {utils.timeit(epoch_time)}')
+                print(f'Skipped batches: {skipped_batches} of {len(train_dataloader)}')
+                if args.workers == 0:
+                    # With workers every process has its own cache
+                    print(train_dataset.scene_cache.stats())
+                save_stats(train_losses, val_ious, train_ious, args.stats_path)
+
+        if validation_worker is not None:
+            collect_validation(validation_worker.close(), val_ious, metrics_log, checkpoint_writer, model_name, args.keep_best)
+        save_stats(train_losses, val_ious, train_ious, args.stats_path)
+    finally:
+        # Also when training fails: queued checkpoints are still written and the metrics log is complete
+        if validation_worker is not None:
+            validation_worker.close(wait=False)
+        if metrics_log is not None:
+            metrics_log.close()
+        checkpoint_writer.close()
+
+def collect_validation(results, val_ious, metrics_log, checkpoint_writer, model_name, keep_best):
+    for val_step, val_iou, state_dict in results:
+        val_ious.append(val_iou)
+        metrics_log.write('validation', step=val_step, iou=val_iou)
+        print(f'\nValidation of train_step {val_step} finished with mean IOU: {val_iou}')
+        if keep_best > 0:
+            # Validated weights are saved with their score, so the best ones survive the retention policy
+            # (a step already saved by save_step is not written again, see CheckpointWriter.write)
+            checkpoint_writer.save_state_dict(state_dict, checkpoint.checkpoint_name(model_name, val_step), score=val_iou)
 
 def get_model(pretrained_weights_file, output_dir, model_class, device):
-    # try to find model in output_dir
-    model_regex = r'(model|MinkUNet\d{2,3}[A-Z]?)_(\d+).pth'
-    models = [re.match(model_regex, f) for f in os.listdir(output_dir) if re.match(model_regex, f)]
-
-    trained_steps = 0
-    if models:
-        model_dict = {int(model.group(2)): model.group(0) for model in models}
-        trained_steps = max(model_dict.keys())
-        pretrained_weights_file = os.path.join(output_dir, model_dict[trained_steps])
+    # try to find model in output_dir, checkpoints that can't be loaded (e.g. from a crash while writing) are skipped
+    trained_steps, latest = checkpoint.find_latest(output_dir)
+    if latest is not None:
+        pretrained_weights_file = latest
 
     print(f'Loading model from {pretrained_weights_file}')
     inseg_global = InteractiveSegmentationModel(pretraining_weights=pretrained_weights_file)
@@ -241,14 +345,17 @@ def load_from_numpy_ignore_missing(path, default=None):
         return data
     return default
 
-def labels_to_logit_shape(labels: torch.Tensor):
-    if len(labels.shape) == 3:
-        return tuple(labels_to_logit_shape(label) for label in labels)
-
-    labels_new = torch.zeros((len(labels), 2))
-    labels_new[labels[:, 0] == 0, 0] = 1
-    labels_new[labels[:, 0] == 1, 1] = 1
-    return labels_new
+def collate_quantized(batch):
+    # Samples voxelized by the data loader: voxel coordinates with batch index, voxel features and labels,
+    # with point labels and the voxel of every point (as a row of the whole batch) if the samples have them
+    if len(batch[0]) == 3:
+        return ME.utils.sparse_collate(*zip(*batch))
+    coords, feats, labels, point_labels, point_voxels = zip(*batch)
+    voxel_offsets = np.cumsum([0] + [len(sample_coords) for sample_coords in coords[:-1]])
+    coords, feats, labels = ME.utils.sparse_collate(coords, feats, labels)
+    point_labels = torch.from_numpy(np.concatenate(point_labels))
+    point_voxels = torch.from_numpy(np.concatenate([voxels + offset for voxels, offset in zip(point_voxels, voxel_offsets)]))
+    return coords, feats, labels, point_labels, point_voxels
 
 def clicks_in_sinput(sinput, batch_size) -> bool:
     assert sinput.F.shape[1] == 5, f'Expected 5 features in sinput (RGB, P+N clicks), got {sinput.F.shape[1]}'
@@ -264,7 +371,7 @@ def clicks_in_sinput(sinput, batch_size) -> bool:
     return True
 
 def labels_in_sinput(slabels) -> bool:
-    local_labels = slabels.F.argmax(dim=1)
+    local_labels = slabels.argmax(dim=1)
     non_zero_labels = torch.sum(local_labels != 0)
     numel = local_labels.numel()
     if non_zero_labels / numel < 0.004:  # less than 0.4% of labels are non-zero
@@ -274,6 +381,16 @@ def labels_in_sinput(slabels) -> bool:
 
     return True
 
+def skip_reason(sinput, slabels, batch_size, max_size):
+    # Why the batch is not used for training, None if it is used
+    if not clicks_in_sinput(sinput, batch_size):
+        return 'no_clicks'
+    if not labels_in_sinput(slabels):
+        return 'no_labels'
+    if max_size is not None and tensor_too_big(sinput, max_size):
+        return 'too_big'
+    return None
+
 def tensor_too_big(sinput, max_size) -> bool:
     if sinput.F.shape[0] > max_size:
         print(f'!!! Skipping batch !!! More elements then max_size: {sinput.F.shape[0]} > {max_size}')
@@ -281,38 +398,8 @@ def tensor_too_big(sinput, max_size) -> bool:
     return False
 
 
-def save_step(model, path, train_step):
-    export_path = os.path.join(path, f'{model.__class__.__name__}_{train_step}.pth')
-    torch.save(model.state_dict(), export_path)
-    print(f'Model saved to: {export_path}\n')
-
-def plot_stats(train_losses, val_ious, train_ious, train_step, graphs_path):
-    # train_losses_str = ', '.join([f'{loss:.5f}' for loss in train_losses])
-    # print(f'\nTest step. Train losses: [{train_losses_str}]') # , Val IoUs: {val_ious}')
-
-    # print(f'train_losses: {train_losses}')
-    # print(f'val_ious: {val_ious}')
-
-    fig, ax = plt.subplots(3, 2)
-    for i in range(2):
-        ax[0, i].plot(train_losses)
-        ax[0, i].set_title('Train losses')
-        ax[0, i].set_xlabel('Trained steps')
-        ax[1, i].plot(train_ious)
-        ax[1, i].set_title('Train IOU')
-        ax[1, i].set_xlabel('Trained steps')
-        ax[2, i].plot(val_ious)
-        ax[2, i].set_title('Validation IOU')
-        ax[2, i].set_xlabel('Test steps')
-
-    ax[0, 0].set_yscale('log')
-    ax[1, 0].set_yscale('log')
-    ax[2, 0].set_yscale('log')
-    plt.tight_layout()
-    print(f'Saving losses to {os.path.join(graphs_path, "losses.png")}')
-    plt.savefig(os.path.join(graphs_path, 'losses.png'))
-    plt.clf()
-
+def save_stats(train_losses, val_ious, train_ious, graphs_path):
+    # Arrays to continue training with (--saved_loss, ...). Plots are made by plot_metrics.py
     np.save(os.path.join(graphs_path, 'train_losses.npy'), train_losses)
     np.save(os.path.join(graphs_path, 'val_ious.npy'), val_ious)
     np.save(os.path.join(graphs_path, 'train_ious.npy'), train_ious)
@@ -322,7 +409,7 @@ def visualize_one_voxelized_point_cloud(sinput, slabels, sout, iou, output_dir,
     pcd_0_idx = sinput.C[:, 0] == 0
     coords = sinput.C[pcd_0_idx, 1:]
     feats = sinput.F[pcd_0_idx, :]
-    labels = slabels.F[pcd_0_idx, :].argmax(dim=1)
+    labels = slabels[pcd_0_idx, :].argmax(dim=1)
     out = sout.F[pcd_0_idx, :].argmax(dim=1)
     # print(f'{coords.shape=}, {feats.shape=}, {labels.shape=}, {out.shape=}')
 
@@ -0,0 +1,61 @@
+import torch
+import MinkowskiEngine as ME
+from torch.profiler import record_function
+
+from metrics import NO_TIMER
+
+
+def labels_to_logit_shape(labels: torch.Tensor):
+    if len(labels.shape) == 3:
+        return tuple(labels_to_logit_shape(label) for label in labels)
+
+    labels_new = torch.zeros((len(labels), 2))
+    labels_new[labels[:, 0] == 0, 0] = 1
+    labels_new[labels[:, 0] == 1, 1] = 1
+    return labels_new
+
+
+def build_inputs(coords, feats, labels, device):
+    # The only quantization of the step: features become one SparseTensor and labels stay a plain tensor aligned
+    # with its rows (the point ME kept for every voxel is at unique_index), instead of a second SparseTensor
+    with record_function('sparse_tensor'):
+        sinput = ME.SparseTensor(feats.float(), coords, device=device)
+    slabels = labels_to_logit_shape(labels).to(device)[sinput.unique_index]
+    return sinput, slabels
+
+
+def point_batch_inputs(batch, device):
+    # Batch of points (ME.utils.batch_sparse_collate), every point is a row of the input,
+    # so inverse_mapping is the voxel of every point
+    coords, feats, labels = batch
+    sinput, slabels = build_inputs(coords, feats, labels, device)
+    return sinput, slabels, labels[:, 0].long(), sinput.inverse_mapping
+
+
+def voxel_batch_inputs(batch, device):
+    # Batch of voxels from the data loader (train.collate_quantized) with the voxel of every point as a row of the input,
+    # point labels and voxels are None when the loader returns only voxels (without --point_iou)
+    if len(batch) == 3:
+        sinput, slabels = build_inputs(*batch, device)
+        return sinput, slabels, None, None
+    coords, feats, labels, point_labels, point_voxels = batch
+    sinput, slabels = build_inputs(coords, feats, labels, device)
+    return sinput, slabels, point_labels.long(), sinput.inverse_mapping[point_voxels.long().to(device)]
+
+
+def optimize(model, optimizer, criterion, sinput, slabels, timer=NO_TIMER):
+    with timer.stage('forward'):
+        sout = model(sinput)
+    with timer.stage('loss'):
+        loss = criterion(sout.F, slabels)
+    with timer.stage('backward'):
+        optimizer.zero_grad()
+        loss.backward()
+    with timer.stage('optimizer'):
+        optimizer.step()
+    return sout, loss
+
+
+def point_predictions(sout, point_voxels):
+    # Prediction of every point is the prediction of its voxel (what sout.slice does, without another coordinate lookup)
+    return sout.F.argmax(dim=1)[point_voxels]
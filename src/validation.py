@@ -0,0 +1,86 @@
+import multiprocessing
+import queue
+
+import torch
+
+from checkpoint import snapshot
+
+
+def run_validation(tasks, results, model_class, device):
+    # Worker process: the model is created once, every task loads a snapshot of the weights into it
+    import compute_iou
+    from InterObject3D.interactive_adaptation import InteractiveSegmentationModel
+
+    inseg_model_class = InteractiveSegmentationModel(pretraining_weights=None)
+    model = inseg_model_class.create_model(None, model_class, device)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        train_step, state_dict, iou_args = task
+        try:
+            model.load_state_dict(state_dict)
+            model.eval()
+            with torch.no_grad():
+                iou = compute_iou.main(dict(iou_args, inseg_model=inseg_model_class, inseg_global=model))
+            results.put((train_step, float(iou), None))
+        except Exception as e:
+            results.put((train_step, None, repr(e)))
+
+
+class ValidationWorker:
+    # Runs compute_iou in a separate process on snapshots of the weights, so training continues while validating.
+    # At most max_pending validations are queued, further test steps are skipped until one finishes.
+    def __init__(self, model_class, device, max_pending=2):
+        context = multiprocessing.get_context('spawn')  # CUDA can't be used in forked processes
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.max_pending = max_pending
+        self.pending = {}  # {train step: snapshot}, kept alive until the worker is done with it
+        self.closed = False
+        self.process = context.Process(target=run_validation, args=(self.tasks, self.results, model_class, device), daemon=True)
+        self.process.start()
+
+    def submit(self, model, train_step, iou_args):
+        if len(self.pending) >= self.max_pending:
+            print(f'\nSkipping validation of train_step {train_step}, {len(self.pending)} validations still running')
+            return False
+        state_dict = snapshot(model)
+        self.pending[train_step] = state_dict
+        self.tasks.put((train_step, state_dict, iou_args))
+        return True
+
+    def poll(self, block=False):
+        # Finished validations as [(train step, mean IoU, snapshot)], block waits for all pending validations
+        finished = []
+        while self.pending:
+            try:
+                train_step, iou, error = self.results.get(timeout=1) if block else self.results.get_nowait()
+            except queue.Empty:
+                if not self.process.is_alive():
+                    print(f'Validation process exited, {len(self.pending)} validations lost')
+                    self.pending.clear()
+                if block:
+                    continue
+                break
+
+            state_dict = self.pending.pop(train_step)
+            if error is not None:
+                print(f'Validation of train_step {train_step} failed: {error}')
+                continue
+            finished.append((train_step, iou, state_dict))
+        return finished
+
+    def close(self, wait=True):
+        # Waits for pending validations and returns them, without wait they are dropped and the process is stopped
+        if self.closed:
+            return []
+        self.closed = True
+        if not wait:
+            self.process.terminate()
+            self.process.join()
+            return []
+        finished = self.poll(block=True)
+        self.tasks.put(None)
+        self.process.join()
+        return finished
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def voxel_coordinates(positions, voxel_size):
+    # Integer voxel coordinates, aligned the same way as MinkowskiEngine (floor of coords / voxel_size)
+    return np.floor(np.asarray(positions) / voxel_size).astype(np.int64)
+
+
+def pack_keys(coords):
+    # One int64 key per voxel, so voxels can be found with 1D sorting instead of np.unique(axis=0)
+    coords = coords - coords.min(axis=0)
+    dims = coords.max(axis=0) + 1
+    return (coords[:, 0] * dims[1] + coords[:, 1]) * dims[2] + coords[:, 2]
+
+
+def quantize(positions, voxel_size):
+    # Returns voxel coordinates of occupied voxels, index of the first point of every voxel,
+    # voxel of every point (inverse) and number of points in every voxel
+    coords = voxel_coordinates(positions, voxel_size)
+    if len(coords) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return coords, empty, empty, empty
+
+    _, index, inverse, counts = np.unique(pack_keys(coords), return_index=True,
+                                          return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    return coords[index], index, inverse, counts
+
+
+def mean_per_voxel(values, inverse, counts):
+    values = np.asarray(values).reshape((len(inverse), -1))
+    sums = np.empty((len(counts), values.shape[1]), dtype=np.float64)
+    for column in range(values.shape[1]):
+        sums[:, column] = np.bincount(inverse, weights=values[:, column], minlength=len(counts))
+    return sums / counts[:, None]
+
+
+def majority_per_voxel(labels, inverse, n_voxels):
+    # Most common label of every voxel, ties go to the smaller label
+    labels = np.asarray(labels).reshape(-1)
+    label_values, label_inverse = np.unique(labels, return_inverse=True)
+    label_inverse = label_inverse.reshape(-1)
+    n_labels = len(label_values)
+
+    pairs, pair_counts = np.unique(inverse * n_labels + label_inverse, return_counts=True)
+    voxels = pairs // n_labels
+
+    # Pairs are sorted by (voxel, label), a stable sort by count keeps that order for ties
+    order = np.lexsort((-pair_counts, voxels))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = voxels[order][1:] != voxels[order][:-1]
+
+    result = np.zeros(n_voxels, dtype=labels.dtype)
+    result[voxels[order][first]] = label_values[pairs[order][first] % n_labels]
+    return result
+
+
+def any_per_voxel(mask, inverse, n_voxels):
+    return np.bincount(inverse, weights=np.asarray(mask).reshape(-1) != 0, minlength=n_voxels) > 0